@@ -3,10 +3,18 @@
 # Controles en pantalla y soporte opcional de mando (pygame), sin depender del teclado global.
 
 import asyncio
+import contextlib
+import json
+import logging
+import logging.handlers
+import random
+import struct
 import threading
+import time
 import tempfile
 import os
 import sys
+from collections import deque
 from queue import Queue, Empty
 from typing import Optional
 
@@ -51,10 +59,33 @@ if getattr(sys, 'frozen', False):
             _MPY_SETUP_LOG.append(f"Directorio NO existe")
 
 import tkinter as tk
-from tkinter import ttk
+from tkinter import filedialog, ttk
 
+from bleak import BleakScanner  # type: ignore
+from bleak.backends.device import BLEDevice  # type: ignore
+from packaging.version import Version  # type: ignore
 from pybricksdev.ble import find_device  # type: ignore
-from pybricksdev.connections.pybricks import PybricksHubBLE  # type: ignore
+from pybricksdev.ble.lwp3.bytecodes import HubKind  # type: ignore
+from pybricksdev.ble.nus import NUS_RX_UUID  # type: ignore
+from pybricksdev.ble.pybricks import (  # type: ignore
+    FW_REV_UUID,
+    PNP_ID_UUID,
+    PYBRICKS_COMMAND_EVENT_UUID,
+    PYBRICKS_HUB_CAPABILITIES_UUID,
+    PYBRICKS_SERVICE_UUID,
+    SW_REV_UUID,
+    Command,
+    Event,
+    HubCapabilityFlag,
+    StatusFlag,
+    unpack_hub_capabilities,
+    unpack_pnp_id,
+)
+from pybricksdev.connections.pybricks import HubDisconnectError, PybricksHub, PybricksHubBLE  # type: ignore
+from pybricksdev.connections import ConnectionState  # type: ignore
+from pybricksdev.tools import chunk  # type: ignore
+import mpy_cross_v5  # type: ignore
+import mpy_cross_v6  # type: ignore
 
 # Soporte opcional de mando con pygame (reemplaza la librería inputs)
 try:
@@ -66,31 +97,126 @@ try:
 except Exception:
     GAMEPAD_AVAILABLE = False
 
-# -------------------- Lógica de comandos a enviar al hub --------------------
+# -------------------- Configuración persistente --------------------
 
-def create_program(drive_cmd: str, claw_cmd: str) -> str:
-    drive_commands = {
-        'adelante': "motorC.run(400)",
-        'atras': "motorC.run(-400)",
-        'izquierda': "motorA.run(-400)",
-        'derecha': "motorA.run(400)",
-        'adelante_lento': "motorC.run(80)",
-        'atras_lento': "motorC.run(-80)",
-        'izquierda_lento': "motorA.run(-80)",
-        'derecha_lento': "motorA.run(80)",
-        'stop': "motorA.stop()\nmotorC.stop()",
-    }
+SETTINGS_PATH = os.path.join(os.path.expanduser('~'), '.spike_claw.json')
 
-    claw_commands = {
-        'cerrar': "motorE.run_angle(200, 1200)",
-        'abrir': "motorE.run_angle(200, -1200)",
-        'cerrar_lento': "motorE.run_angle(100, 250)",
-        'abrir_lento': "motorE.run_angle(100, -250)",
-        'stop': "motorE.stop()",
-    }
+def load_settings() -> dict:
+    try:
+        with open(SETTINGS_PATH, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_settings(settings: dict):
+    # Escritura atómica: un cierre a mitad de escritura no deja el archivo corrupto
+    tmp_path = SETTINGS_PATH + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(settings, f, indent=2)
+        os.replace(tmp_path, SETTINGS_PATH)
+    except OSError:
+        pass
+
+# -------------------- Lógica de comandos a enviar al hub --------------------
+
+# Velocidad (grados/s) por puerto para cada comando de conducción; 0 = parar el motor.
+DRIVE_COMMANDS = {
+    'adelante': (('C', 400),),
+    'atras': (('C', -400),),
+    'izquierda': (('A', -400),),
+    'derecha': (('A', 400),),
+    'adelante_lento': (('C', 80),),
+    'atras_lento': (('C', -80),),
+    'izquierda_lento': (('A', -80),),
+    'derecha_lento': (('A', 80),),
+    'stop': (('A', 0), ('C', 0)),
+}
+
+# Posiciones de la garra (grados del motor E): abierta y cerrada. Los programas crean el motor con
+# reset_angle=False para que el ángulo se conserve entre programas (se asume la garra abierta al
+# encender el hub); si se atasca al abrir, ese tope pasa a ser CLAW_OPEN.
+CLAW_OPEN = 0
+CLAW_CLOSED = 1200
+
+# (velocidad, ángulo) de cada comando de garra; None = parar la garra. Los de CLAW_ABSOLUTE van a
+# una posición absoluta (repetirlos no mueve la garra); el resto son ajustes relativos.
+CLAW_COMMANDS = {
+    'cerrar': (200, CLAW_CLOSED),
+    'abrir': (200, CLAW_OPEN),
+    'cerrar_lento': (100, 250),
+    'abrir_lento': (100, -250),
+    'stop': None,
+}
+CLAW_ABSOLUTE = frozenset(('cerrar', 'abrir'))
+
+# Motor de la garra en los programas del hub: movimientos sin bloquear (run_target) y parada si se
+# atasca contra un tope o un objeto, en lugar de seguir empujando hasta completar el ángulo.
+CLAW_MOTOR_CODE = f"""motorE = Motor(Port.E, reset_angle=False)
+claw_goal = [{CLAW_OPEN}]
+
+def claw_move(speed, angle, absolute):
+    claw_goal[0] = angle if absolute else motorE.angle() + angle
+    motorE.run_target(speed, claw_goal[0], wait=False)
+
+def claw_guard():
+    if not motorE.done() and motorE.stalled():
+        if claw_goal[0] < motorE.angle():
+            motorE.reset_angle({CLAW_OPEN})
+        motorE.hold()"""
+
+def _drive_code(drive_cmd: str) -> str:
+    spec = DRIVE_COMMANDS.get(drive_cmd, DRIVE_COMMANDS['stop'])
+    return "\n".join(
+        f"motor{port}.run({speed})" if speed else f"motor{port}.stop()"
+        for port, speed in spec
+    )
+
+def _claw_code(claw_cmd: str) -> str:
+    # La garra no bloquea: la conducción (A/C) y la garra (E) avanzan a la vez en el hub
+    spec = CLAW_COMMANDS.get(claw_cmd)
+    if spec is None:
+        return "motorE.stop()"
+    speed, angle = spec
+    return f"claw_move({speed}, {angle}, {claw_cmd in CLAW_ABSOLUTE})"
+
+# Fin de una orden sin hold: deja rodar la conducción un momento y espera a que la garra termine
+CLAW_SETTLE_CODE = """wait(300)
+while not motorE.done():
+    claw_guard()
+    wait(10)"""
+
+# Perro guardián: sin un latido del host en este plazo el hub para los motores. Los latidos se
+# envían cada WATCHDOG_TIMEOUT / WATCHDOG_BEATS s mientras haya una orden en marcha (0 = sin perro).
+WATCHDOG_TIMEOUT = 0.75
+WATCHDOG_BEATS = 3
+
+def _hold_code(hold_ms: int) -> str:
+    # Sin hold_ms el programa termina tras la orden (y el firmware para los motores). Con hold_ms
+    # sigue en marcha mientras lleguen latidos (cualquier byte por stdin) antes de que venza el plazo;
+    # la garra se mueve en segundo plano, así que el perro vigila también durante su recorrido.
+    if not hold_ms:
+        return CLAW_SETTLE_CODE
+    return f"""
+from pybricks.tools import StopWatch
+from usys import stdin
+from uselect import poll
+
+keyboard = poll()
+keyboard.register(stdin)
+watchdog = StopWatch()
+while watchdog.time() < {hold_ms}:
+    while keyboard.poll(0):
+        stdin.read(1)
+        watchdog.reset()
+    claw_guard()
+    wait(10)
+"""
 
-    drive_code = drive_commands.get(drive_cmd, "motorA.stop()\nmotorC.stop()")
-    claw_code = claw_commands.get(claw_cmd, "motorE.stop()")
+def create_program(drive_cmd: str, claw_cmd: str, hold_ms: int = 0) -> str:
+    drive_code = _drive_code(drive_cmd)
+    claw_code = _claw_code(claw_cmd)
 
     program = f"""
 from pybricks.hubs import PrimeHub
@@ -102,100 +228,1997 @@ hub = PrimeHub()
 
 motorA = Motor(Port.A)
 motorC = Motor(Port.C)
-motorE = Motor(Port.E)
+{CLAW_MOTOR_CODE}
 
 {drive_code}
 {claw_code}
-wait(300)
+{_hold_code(hold_ms)}
 """
     return program
 
-def compute_drive_command(pressed: set) -> str:
-    w = 'w' in pressed
-    s = 's' in pressed
-    a = 'a' in pressed
-    d = 'd' in pressed
-    i = 'i' in pressed
-    j = 'j' in pressed
-    k = 'k' in pressed
-    l = 'l' in pressed
-
-    if i or j or k or l:
-        if i:
-            return 'adelante_lento'
-        if k:
-            return 'atras_lento'
-        if j:
-            return 'izquierda_lento'
-        if l:
-            return 'derecha_lento'
-
-    if w and not s:
-        return 'adelante'
-    if s and not w:
-        return 'atras'
-    if a and not d:
-        return 'izquierda'
-    if d and not a:
-        return 'derecha'
+# -------------------- Modo streaming (programa residente en el hub) --------------------
+# En lugar de compilar y descargar un programa por cada orden, se descarga una sola vez
+# un intérprete que lee órdenes compactas por stdin (WRITE_STDIN) y las aplica al instante.
+# Protocolo: una línea por orden, "M<drive><claw>\n", con el índice de cada comando en
+# DRIVE_COMMANDS / CLAW_COMMANDS (un dígito cada uno). Conducción (A/C) y garra (E) son canales
+# independientes que el hub mueve a la vez: "D<drive>\n" cambia sólo la conducción y "C<claw>\n"
+# sólo la garra, sin interrumpir al otro canal. Conducción analógica: "V<velA>,<velC>\n" fija las
+# velocidades (grados/s) de A y C.
+# Telemetría: "T<ms>\n" fija el periodo de muestreo (0 = apagada); el hub responde por stdout con
+# tramas binarias TELEMETRY_FORMAT + 1 byte de suma (ver TelemetryDecoder).
+# Perro guardián: "W<ms>\n" fija el plazo (0 = apagado). Cada línea recibida cuenta como latido; si
+# pasa el plazo sin ninguna, el hub para todos los motores. El host repite la orden en curso como latido.
+
+DRIVE_INDEX = {name: i for i, name in enumerate(DRIVE_COMMANDS)}
+CLAW_INDEX = {name: i for i, name in enumerate(CLAW_COMMANDS)}
+
+# sincronía, secuencia, tiempo (ms), (ángulo, velocidad, carga) de A, C y E, batería (mV),
+# inclinación (pitch, roll) y rumbo, en grados
+TELEMETRY_FORMAT = '<BBH' + 'ihh' * 3 + 'Hhhh'
+TELEMETRY_SYNC = 0xA5
+
+def create_resident_program() -> str:
+    # Tablas por índice: conducción -> (velocidad A, velocidad C); garra -> (velocidad, ángulo, absoluto) o None
+    drive_table = tuple(
+        (dict(spec).get('A', 0), dict(spec).get('C', 0)) for spec in DRIVE_COMMANDS.values()
+    )
+    claw_table = tuple(
+        None if spec is None else spec + (name in CLAW_ABSOLUTE,) for name, spec in CLAW_COMMANDS.items()
+    )
+
+    program = f"""
+from pybricks.hubs import PrimeHub
+from pybricks.pupdevices import Motor
+from pybricks.parameters import Port
+from pybricks.tools import wait, StopWatch
+from usys import stdin, stdout
+from uselect import poll
+from ustruct import pack
+
+hub = PrimeHub()
+
+motorA = Motor(Port.A)
+motorC = Motor(Port.C)
+{CLAW_MOTOR_CODE}
+
+DRIVE = {drive_table!r}
+CLAW = {claw_table!r}
+HAS_LOAD = hasattr(motorA, 'load')
+
+def sample(motor):
+    return motor.angle(), motor.speed(), motor.load() if HAS_LOAD else 0
+
+def send_telemetry(seq, now):
+    pitch, roll = hub.imu.tilt()
+    frame = pack({TELEMETRY_FORMAT!r}, {TELEMETRY_SYNC}, seq, now & 0xFFFF,
+                 *sample(motorA), *sample(motorC), *sample(motorE),
+                 hub.battery.voltage(), int(pitch), int(roll), int(hub.imu.heading()) % 360)
+    stdout.buffer.write(frame + bytes((sum(frame) & 0xFF,)))
+
+def run_or_stop(motor, speed):
+    if speed:
+        motor.run(speed)
+    else:
+        motor.stop()
+
+def drive(d, state):
+    if d != state[0]:
+        speed_a, speed_c = DRIVE[d]
+        run_or_stop(motorA, speed_a)
+        run_or_stop(motorC, speed_c)
+        state[0] = d
+
+def claw(c, state):
+    if c != state[1]:
+        spec = CLAW[c]
+        if spec is None:
+            motorE.stop()
+        else:
+            claw_move(*spec)
+        state[1] = c
+
+def apply(line, state):
+    if not line:
+        return
+    op = line[0]
+    if op == 'V':
+        speed_a, _, speed_c = line[1:].partition(',')
+        run_or_stop(motorA, int(speed_a))
+        run_or_stop(motorC, int(speed_c))
+        # Ningún comando discreto en curso: la siguiente "M" vuelve a aplicarse
+        state[0] = -1
+    elif op == 'D' and len(line) >= 2:
+        drive(int(line[1]), state)
+    elif op == 'C' and len(line) >= 2:
+        claw(int(line[1]), state)
+    elif op == 'T':
+        state[2] = int(line[1:])
+    elif op == 'W':
+        state[3] = int(line[1:])
+    elif op == 'M' and len(line) >= 3:
+        drive(int(line[1]), state)
+        claw(int(line[2]), state)
+
+keyboard = poll()
+keyboard.register(stdin)
+# drive, garra, periodo de telemetría (ms), plazo del perro guardián (ms)
+state = [{DRIVE_INDEX['stop']}, {CLAW_INDEX['stop']}, 0, 0]
+buf = ''
+watch = StopWatch()
+next_sample = 0
+seq = 0
+last_line = 0
+armed = False
+
+while True:
+    while keyboard.poll(0):
+        ch = stdin.read(1)
+        if ch == '\\n':
+            last_line = watch.time()
+            armed = True
+            try:
+                apply(buf, state)
+            except (ValueError, IndexError):
+                pass
+            buf = ''
+        else:
+            buf += ch
+    if armed and state[3] and watch.time() - last_line > state[3]:
+        # Sin latidos del host: parar todo; el siguiente latido vuelve a aplicar la orden
+        motorA.stop()
+        motorC.stop()
+        motorE.stop()
+        state[0] = {DRIVE_INDEX['stop']}
+        state[1] = {CLAW_INDEX['stop']}
+        armed = False
+    if state[2] and watch.time() >= next_sample:
+        now = watch.time()
+        next_sample = now + state[2]
+        seq = (seq + 1) & 0xFF
+        send_telemetry(seq, now)
+    claw_guard()
+    wait(5)
+"""
+    return program
+
+def encode_stream_command(drive_cmd: str, claw_cmd: str) -> bytes:
+    d = DRIVE_INDEX.get(drive_cmd, DRIVE_INDEX['stop'])
+    c = CLAW_INDEX.get(claw_cmd, CLAW_INDEX['stop'])
+    return f"M{d}{c}\n".encode()
+
+def encode_speed_command(speeds: tuple) -> bytes:
+    return f"V{speeds[0]},{speeds[1]}\n".encode()
+
+def encode_drive_command(drive_cmd: str) -> bytes:
+    return f"D{DRIVE_INDEX.get(drive_cmd, DRIVE_INDEX['stop'])}\n".encode()
+
+def encode_claw_command(claw_cmd: str) -> bytes:
+    return f"C{CLAW_INDEX.get(claw_cmd, CLAW_INDEX['stop'])}\n".encode()
+
+def encode_channel_command(last: dict, state: dict) -> bytes:
+    """Línea discreta más corta que lleva al hub de last a state: sólo el canal que cambió."""
+    if last['claw'] is not None and last['claw'] == state['claw']:
+        return encode_drive_command(state['drive'])
+    if last['drive'] is not None and last['drive'] == state['drive'] and last['speeds'] is None:
+        return encode_claw_command(state['claw'])
+    return encode_stream_command(state['drive'], state['claw'])
+
+def encode_telemetry_command(rate: float) -> bytes:
+    period_ms = int(round(1000 / rate)) if rate > 0 else 0
+    return f"T{period_ms}\n".encode()
+
+def encode_watchdog_command(timeout: float) -> bytes:
+    return f"W{int(round(timeout * 1000))}\n".encode()
+
+# Latido de los programas por orden con hold_ms (cualquier byte sirve)
+HEARTBEAT = b'.'
+
+def state_is_idle(state: dict) -> bool:
+    # None = aún no se envió nada (tras conectar o reiniciar el residente): tampoco se mueve
+    return state['drive'] in (None, 'stop') and state['claw'] in (None, 'stop') and not state['speeds']
+
+def encode_state_command(state: dict) -> bytes:
+    # Línea que reproduce el estado completo de conducción (sirve de latido)
+    if state['speeds'] is not None:
+        return encode_speed_command(state['speeds'])
+    return encode_stream_command(state['drive'], state['claw'])
+
+# -------------------- Conducción analógica --------------------
+# El stick izquierdo fija velocidades continuas: eje X -> motor A (giro, derecha +),
+# eje Y -> motor C (avance, adelante +). Las consignas se cuantizan a ANALOG_STEP para que el
+# ruido del stick no genere envíos, y se limitan a analog_rate consignas/s por hub.
+
+ANALOG_MAX_SPEED = 400
+ANALOG_STEP = 10
+ANALOG_DEADZONE = 0.08
+ANALOG_MAX_RATE = 20.0
+
+def quantize_axis(value: float, max_speed: int = ANALOG_MAX_SPEED, step: int = ANALOG_STEP,
+                  dead: float = ANALOG_DEADZONE) -> int:
+    magnitude = abs(value)
+    if magnitude < dead:
+        return 0
+    # Reescalado tras la zona muerta: empieza en 0 y llega a max_speed con el stick al tope
+    magnitude = min((magnitude - dead) / (1 - dead), 1.0)
+    speed = int(round(magnitude * max_speed / step)) * step
+    return speed if value > 0 else -speed
+
+def stick_to_speeds(x: float, y: float) -> tuple:
+    """Consigna (velocidad A, velocidad C) en grados/s para un stick; (0, 0) = sin consigna."""
+    # En pygame el eje Y es positivo hacia abajo
+    return quantize_axis(x), quantize_axis(-y)
+
+def speeds_to_command(speeds: tuple) -> str:
+    """Comando discreto más parecido a una consigna (sin programa residente)."""
+    speed_a, speed_c = speeds
+    if abs(speed_c) >= abs(speed_a):
+        name = 'adelante' if speed_c > 0 else 'atras'
+        speed = speed_c
+    else:
+        name = 'derecha' if speed_a > 0 else 'izquierda'
+        speed = speed_a
+    if speed == 0:
+        return 'stop'
+    return name if abs(speed) > ANALOG_MAX_SPEED * 0.6 else name + '_lento'
+
+# -------------------- Telemetría del hub --------------------
+# Las tramas llegan por WRITE_STDOUT (stdout_observable) troceadas según el MTU; el decodificador
+# las resincroniza por el byte TELEMETRY_SYNC y la suma final, y guarda las muestras en un búfer
+# circular de tamaño fijo. Decodificar se hace en el callback BLE, así que debe ser barato
+# (ver "benchmarks.py telemetry").
+
+TELEMETRY_STRUCT = struct.Struct(TELEMETRY_FORMAT)
+TELEMETRY_FRAME_SIZE = TELEMETRY_STRUCT.size + 1
+TELEMETRY_HISTORY = 512
+# Muestras por segundo por defecto al activar la telemetría
+TELEMETRY_DEFAULT_RATE = 10.0
+TELEMETRY_FIELDS = (
+    'seq', 'time_ms',
+    'a_angle', 'a_speed', 'a_load',
+    'c_angle', 'c_speed', 'c_load',
+    'e_angle', 'e_speed', 'e_load',
+    'battery_mv', 'pitch', 'roll', 'heading',
+)
+
+class TelemetryDecoder:
+    """Reensambla tramas de telemetría del stdout del hub en un búfer circular de muestras."""
+    def __init__(self, history: int = TELEMETRY_HISTORY):
+        self.samples = deque(maxlen=history)
+        self.frames = 0
+        self.errors = 0
+        self._buf = bytearray()
+
+    def feed(self, data: bytes):
+        buf = self._buf
+        buf.extend(data)
+        unpack_from = TELEMETRY_STRUCT.unpack_from
+        size = TELEMETRY_STRUCT.size
+        start = 0
+        while True:
+            start = buf.find(TELEMETRY_SYNC, start)
+            if start < 0 or len(buf) - start < TELEMETRY_FRAME_SIZE:
+                break
+            end = start + size
+            if sum(buf[start:end]) & 0xFF != buf[end]:
+                # Byte de sincronía falso (texto, traza de error…): buscar el siguiente
+                self.errors += 1
+                start += 1
+                continue
+            self.samples.append(unpack_from(buf, start)[1:])
+            self.frames += 1
+            start = end + 1
+        # Conservar sólo una trama incompleta al final
+        if start < 0:
+            buf.clear()
+        elif start:
+            del buf[:start]
+
+    def latest(self) -> Optional[dict]:
+        if not self.samples:
+            return None
+        return dict(zip(TELEMETRY_FIELDS, self.samples[-1]))
+
+# -------------------- Estado de entrada (máscara de bits) y tablas de comandos --------------------
+# Las teclas pulsadas de cualquier fuente (GUI, mando…) se representan como un entero: un bit
+# por tecla de INPUT_KEYS. El par (drive, claw) de cada combinación posible se precalcula a partir
+# de las reglas declarativas DRIVE_RULES / CLAW_RULES, así resolver un fotograma es un índice.
+
+INPUT_KEYS = ('w', 'a', 's', 'd', 'i', 'j', 'k', 'l', 'x', 'z', 'm', 'n')
+KEY_BIT = {key: 1 << i for i, key in enumerate(INPUT_KEYS)}
+
+# (comando, teclas que deben estar pulsadas, teclas que no deben estarlo), por prioridad:
+# gana la primera regla que se cumple y, si no se cumple ninguna, 'stop'.
+DRIVE_RULES = (
+    ('adelante_lento', 'i', ''),
+    ('atras_lento', 'k', ''),
+    ('izquierda_lento', 'j', ''),
+    ('derecha_lento', 'l', ''),
+    ('adelante', 'w', 's'),
+    ('atras', 's', 'w'),
+    ('izquierda', 'a', 'd'),
+    ('derecha', 'd', 'a'),
+)
+CLAW_RULES = (
+    ('cerrar', 'x', 'z'),
+    ('abrir', 'z', 'x'),
+    ('cerrar_lento', 'm', 'n'),
+    ('abrir_lento', 'n', 'm'),
+)
+
+def keys_mask(keys) -> int:
+    """Máscara de bits de un iterable de teclas (las desconocidas se ignoran)."""
+    mask = 0
+    for key in keys:
+        mask |= KEY_BIT.get(key, 0)
+    return mask
+
+def _resolve(rules, mask: int) -> str:
+    for cmd, required, excluded in rules:
+        need = keys_mask(required)
+        if mask & need == need and not mask & keys_mask(excluded):
+            return cmd
     return 'stop'
 
-async def execute_command(hub: PybricksHubBLE, drive_cmd: str, claw_cmd: str, log_cb=None):
-    program = create_program(drive_cmd, claw_cmd)
-    
-    # Usar directorio temporal del sistema
-    temp_dir = tempfile.gettempdir()
-    temp_path = os.path.join(temp_dir, f'spike_program_{id(program)}.py')
-    
+# COMMAND_TABLE[máscara] = (drive_cmd, claw_cmd) para las 4096 combinaciones de teclas
+COMMAND_TABLE = tuple(
+    (_resolve(DRIVE_RULES, mask), _resolve(CLAW_RULES, mask))
+    for mask in range(1 << len(INPUT_KEYS))
+)
+
+def compute_drive_command(pressed: set) -> str:
+    return COMMAND_TABLE[keys_mask(pressed)][0]
+
+def _check_mpy_cross_path(log_cb):
+    # Verificar PATH si está empaquetado (para debug)
+    if getattr(sys, 'frozen', False) and log_cb:
+        path_dirs = os.environ.get('PATH', '').split(os.pathsep)
+        mpy_found = any('mpy' in d.lower() for d in path_dirs)
+        if not mpy_found:
+            log_cb("Advertencia: mpy-cross no encontrado en PATH")
+
+# -------------------- Trazas de latencia por orden --------------------
+# Cada cambio de entrada abre una traza con un trace_id; cada etapa (lock, cola, create_program,
+# mpy-cross, descarga GATT, start_user_program, espera…) registra marcas perf_counter_ns.
+# Se guardan las últimas duraciones por etapa para p50/p95/p99 y los últimos eventos para
+# exportarlos en formato Chrome trace-event (chrome://tracing, Perfetto).
+
+TRACE_HISTORY = 8192
+TRACE_WINDOW = 1024
+
+class _NullTrace:
+    trace_id = None
+
+    def stage(self, name: str):
+        return contextlib.nullcontext()
+
+    def mark(self, name: str):
+        pass
+
+    def finish(self):
+        pass
+
+NULL_TRACE = _NullTrace()
+
+class CommandTrace:
+    def __init__(self, tracer: 'LatencyTracer', trace_id: int, track: str, start_ns: int):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.track = track
+        self.start_ns = start_ns
+        self.last_ns = start_ns
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.tracer.record(self, name, start, time.perf_counter_ns())
+
+    def mark(self, name: str):
+        # Etapa que termina ahora y empezó al acabar la anterior (p. ej. la espera en cola)
+        self.tracer.record(self, name, self.last_ns, time.perf_counter_ns())
+
+    def finish(self):
+        self.tracer.record(self, 'total', self.start_ns, time.perf_counter_ns())
+
+class LatencyTracer:
+    """Registro de trazas por orden: percentiles por etapa y exportación Chrome trace."""
+    def __init__(self):
+        self.events = deque(maxlen=TRACE_HISTORY)
+        self.durations = {}
+        # Etapas registradas desde el inicio (la ventana de durations está acotada)
+        self.counts = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def begin(self, track: str, start_ns: int) -> CommandTrace:
+        with self._lock:
+            trace_id = self._next_id
+            self._next_id += 1
+        return CommandTrace(self, trace_id, track, start_ns)
+
+    def record(self, trace: CommandTrace, name: str, start_ns: int, end_ns: int):
+        with self._lock:
+            self.events.append((trace.trace_id, trace.track, name, start_ns, end_ns))
+            window = self.durations.get(name)
+            if window is None:
+                window = self.durations[name] = deque(maxlen=TRACE_WINDOW)
+            window.append(end_ns - start_ns)
+            self.counts[name] = self.counts.get(name, 0) + 1
+        if name != 'total':
+            trace.last_ns = max(trace.last_ns, end_ns)
+
+    def percentiles(self) -> dict:
+        """{etapa: {'n', 'p50', 'p95', 'p99'}} en milisegundos."""
+        with self._lock:
+            windows = {name: sorted(values) for name, values in self.durations.items()}
+        result = {}
+        for name, values in windows.items():
+            if not values:
+                continue
+            pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] / 1e6
+            result[name] = {'n': len(values), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+        return result
+
+    def report(self) -> str:
+        rows = [f"{'etapa':<20} {'n':>5} {'p50':>8} {'p95':>8} {'p99':>8}  (ms)"]
+        for name, p in sorted(self.percentiles().items(), key=lambda item: item[0] == 'total'):
+            rows.append(f"{name:<20} {p['n']:>5} {p['p50']:>8.2f} {p['p95']:>8.2f} {p['p99']:>8.2f}")
+        return "\n".join(rows)
+
+    def chrome_trace(self) -> dict:
+        with self._lock:
+            events = list(self.events)
+        tracks = {}
+        trace_events = []
+        for trace_id, track, name, start_ns, end_ns in events:
+            tid = tracks.setdefault(track, len(tracks) + 1)
+            trace_events.append({
+                'name': name, 'cat': 'orden', 'ph': 'X', 'pid': 1, 'tid': tid,
+                'ts': start_ns / 1000, 'dur': (end_ns - start_ns) / 1000,
+                'args': {'trace_id': trace_id},
+            })
+        for track, tid in tracks.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                                 'args': {'name': track}})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+
+# -------------------- Compilación y descarga en memoria --------------------
+
+async def compile_source(source, abi, file_name: str = '__main__.py') -> bytes:
+    """Compila código fuente (str o bytes) con mpy-cross y devuelve el MPY, sin tocar el disco.
+
+    abi es la versión ABI MPY como en pybricksdev.compile: 5, 6 o (6, minor). Con ABI 5
+    (firmware antiguo) se devuelve el MPY tal cual; con ABI 6 se usa el formato
+    multi-archivo de compile_multi_file (tamaño, nombre del módulo, datos MPY).
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = bytes(source).decode('utf-8')
+    abi_major = abi if isinstance(abi, int) else abi[0]
+
+    # mpy-cross recibe el código por stdin: no se escribe ningún archivo temporal.
+    loop = asyncio.get_running_loop()
+    if abi_major == 5:
+        proc, mpy = await loop.run_in_executor(
+            None, lambda: mpy_cross_v5.mpy_cross_compile(file_name, source, no_unicode=True)
+        )
+    elif abi_major == 6:
+        proc, mpy = await loop.run_in_executor(
+            None, lambda: mpy_cross_v6.mpy_cross_compile(file_name, source)
+        )
+    else:
+        raise ValueError("mpy_version must be 5 or 6")
+    proc.check_returncode()
+
+    if abi_major == 5:
+        return mpy
+    module_name = os.path.splitext(file_name)[0]
+    return len(mpy).to_bytes(4, 'little') + module_name.encode() + b'\x00' + mpy
+
+def mpy_abi_from_flags(flags):
+    """ABI MPY (como en compile_multi_file) según los flags de capacidad del hub, o None."""
+    if flags & HubCapabilityFlag.USER_PROG_MULTI_FILE_MPY6_1_NATIVE:
+        return (6, 1)
+    if flags & HubCapabilityFlag.USER_PROG_MULTI_FILE_MPY6:
+        return 6
+    return None
+
+def hub_mpy_abi(hub):
+    """ABI MPY que acepta el hub (como en compile_multi_file) o None si es firmware antiguo."""
+    if hub._mpy_abi_version:
+        # Perfil Pybricks < 1.2.0: descarga heredada por NUS, no se usa la descarga directa
+        return None
+    return mpy_abi_from_flags(hub._capability_flags)
+
+class HubStdinStream:
+    """Flujo hacia stdin del hub: agrupa escrituras pequeñas en paquetes completos y aplica
+    contrapresión (drain) cuando el búfer supera high_water, como asyncio.StreamWriter.
+
+    Las escrituras sin respuesta se solapan hasta `window` a la vez; con respuesta se
+    serializan, porque ATT sólo admite una petición pendiente y el orden debe mantenerse.
+    """
+    def __init__(self, hub, window: int = 4, high_water: int = 1024, low_water: int = 256):
+        self._hub = hub
+        self.high_water = high_water
+        self.low_water = low_water
+        self._buf = bytearray()
+        self._window = asyncio.Semaphore(window)
+        self._data_ready = asyncio.Event()
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._in_flight = 0
+        self._error = None
+        self.closed = False
+        self.packets = 0
+        self.bytes_sent = 0
+        self._task = asyncio.ensure_future(self._flusher())
+
+    def write(self, data: bytes):
+        if self._error is not None:
+            raise self._error
+        if self.closed:
+            raise RuntimeError("stdin stream is closed")
+        if not data:
+            return
+        self._buf.extend(data)
+        self._idle.clear()
+        self._data_ready.set()
+        if len(self._buf) >= self.high_water:
+            self._can_write.clear()
+
+    async def drain(self):
+        """Espera a que el búfer baje de low_water (no a que todo esté enviado)."""
+        await self._wait(self._can_write)
+
+    async def flush(self):
+        """Espera a que todo lo escrito haya salido hacia el hub."""
+        await self._wait(self._idle)
+
+    async def _wait(self, event: asyncio.Event):
+        if self._error is not None:
+            raise self._error
+        waiter = asyncio.ensure_future(event.wait())
+        try:
+            await asyncio.wait({waiter, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def error(self) -> Optional[Exception]:
+        """Excepción de la escritura que detuvo el flujo, o None si sigue en marcha."""
+        return self._error
+
+    def close(self):
+        self.closed = True
+        self._task.cancel()
+
+    async def _flusher(self):
+        try:
+            while True:
+                await self._data_ready.wait()
+                if not self._buf:
+                    self._data_ready.clear()
+                    if self._in_flight == 0:
+                        self._idle.set()
+                    continue
+
+                size = self._hub._max_write_size - 1
+                packet = bytes(self._buf[:size])
+                del self._buf[:size]
+                if len(self._buf) <= self.low_water:
+                    self._can_write.set()
+
+                if self._hub._command_write_without_response():
+                    await self._window.acquire()
+                    self._in_flight += 1
+                    asyncio.ensure_future(self._send(packet, response=False))
+                else:
+                    self._in_flight += 1
+                    await self._send(packet, response=True)
+                    if self._error is not None:
+                        return
+        except asyncio.CancelledError:
+            pass
+
+    async def _send(self, packet: bytes, response: bool):
+        try:
+            await self._hub._write_stdin_packet(packet, response)
+            self.packets += 1
+            self.bytes_sent += len(packet)
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+                self._task.cancel()
+        finally:
+            self._in_flight -= 1
+            if not response:
+                self._window.release()
+            if self._in_flight == 0 and not self._buf:
+                self._idle.set()
+
+class SpikeHubMixin:
+    """Extensiones de PybricksHub para ejecutar programas desde memoria (sin archivos .py)."""
+
+    # Último programa escrito en cada ranura del hub durante esta conexión (para descargas delta);
+    # la ranura es la seleccionada en el hub (_selected_slot, del STATUS_REPORT)
+    _last_programs: Optional[dict] = None
+    bytes_downloaded: int = 0
+    bytes_skipped: int = 0
+
+    # Flujo de stdin (se crea al primer uso en cada conexión)
+    _stdin: Optional[HubStdinStream] = None
+    stdin_window: int = 4
+
+    async def connect(self):
+        # Tras (re)conectar no se sabe qué hay en la RAM del hub
+        self._last_programs = {}
+        self._close_stdin_stream()
+        await super().connect()
+
+    async def disconnect(self):
+        self._close_stdin_stream()
+        await super().disconnect()
+
+    def stdin_stream(self) -> HubStdinStream:
+        stream = self._stdin
+        if stream is not None and stream.error is not None:
+            # Una escritura fallida (p. ej. un BleakError pasajero) detuvo el flujo: se descarta
+            # y se crea otro; si el enlace cayó de verdad, el supervisor de desconexión actúa
+            stream.close()
+            stream = None
+        if stream is None or stream.closed:
+            self._stdin = stream = HubStdinStream(self, window=self.stdin_window)
+        return stream
+        return self._stdin
+
+    def _close_stdin_stream(self):
+        if self._stdin is not None:
+            self._stdin.close()
+            self._stdin = None
+
+    async def write(self, data: bytes) -> None:
+        """Escribe en stdin del hub a través del flujo: sin límite de tamaño por llamada y
+        sin esperar la confirmación de cada paquete (sólo la contrapresión del búfer)."""
+        stream = self.stdin_stream()
+        stream.write(data)
+        await stream.drain()
+
+    async def write_acked(self, data: bytes) -> bool:
+        """Escribe en stdin esperando la confirmación del hub, detrás de lo ya encolado en el flujo.
+
+        Devuelve False si no se pudo pedir confirmación (NUS heredado o más de un paquete).
+        """
+        stream = self.stdin_stream()
+        await stream.flush()
+        if self._legacy_stdio or len(data) > self._max_write_size - 1:
+            stream.write(data)
+            await stream.drain()
+            return False
+        await self._write_stdin_packet(data, True)
+        return True
+
+    async def _write_stdin_packet(self, data: bytes, response: bool):
+        # Igual que PybricksHub.write, pero eligiendo si se espera respuesta
+        if self._legacy_stdio:
+            await self.write_gatt_char(NUS_RX_UUID, data, False)
+        else:
+            await self.write_gatt_char(
+                PYBRICKS_COMMAND_EVENT_UUID, bytes([Command.WRITE_STDIN]) + data, response
+            )
+
+    async def download_user_program(self, program: bytes) -> None:
+        """Como PybricksHub.download_user_program, pero sólo reescribe los fragmentos que cambian.
+
+        Si el programa es idéntico al último descargado en la misma ranura no se envía nada.
+        """
+        program = bytes(program)
+        if len(program) > self._max_user_program_size:
+            raise ValueError(
+                f"program is too big ({len(program)} bytes). Hub has limit of {self._max_user_program_size} bytes."
+            )
+
+        if self._last_programs is None:
+            self._last_programs = {}
+        # Si alguien cambia la ranura en el hub, el delta se calcula contra lo que hay en la nueva
+        slot = self._selected_slot
+        previous = self._last_programs.get(slot)
+        if previous == program:
+            self.bytes_skipped += len(program)
+            return
+
+        # Si la descarga falla a medias la RAM queda en un estado desconocido
+        self._last_programs.pop(slot, None)
+
+        # clear user program meta so hub doesn't try to run invalid program
+        await self.write_gatt_char(
+            PYBRICKS_COMMAND_EVENT_UUID,
+            struct.pack("<BI", Command.WRITE_USER_PROGRAM_META, 0),
+            response=True,
+        )
+
+        # payload is max size minus header size
+        payload_size = self._max_write_size - 5
+
+        pending = []
+        for i, c in enumerate(chunk(program, payload_size)):
+            offset = i * payload_size
+            if previous is not None and previous[offset:offset + len(c)] == c:
+                self.bytes_skipped += len(c)
+                continue
+            pending.append((offset, c))
+
+        # Siempre con respuesta: sin ella el hub no avisa si rechaza un fragmento (p. ej. BUSY) y
+        # el protocolo no permite leer la RAM para comprobarla, así que el delta no sería fiable
+        for offset, c in pending:
+            await self._write_user_ram(offset, c, response=True)
+
+        # set the metadata to notify that writing was successful
+        await self.write_gatt_char(
+            PYBRICKS_COMMAND_EVENT_UUID,
+            struct.pack("<BI", Command.WRITE_USER_PROGRAM_META, len(program)),
+            response=True,
+        )
+        self._last_programs[slot] = program
+
+    def _command_write_without_response(self) -> bool:
+        """True si la característica de comandos admite escritura sin respuesta."""
+        return False
+
+    async def _write_user_ram(self, offset: int, data: bytes, response: bool):
+        await self.write_gatt_char(
+            PYBRICKS_COMMAND_EVENT_UUID,
+            struct.pack(f"<BI{len(data)}s", Command.COMMAND_WRITE_USER_RAM, offset, data),
+            response=response,
+        )
+        self.bytes_downloaded += len(data)
+
+    async def download_bytes(self, mpy: bytes) -> None:
+        """Descarga un programa ya compilado (formato de compile_source) a la RAM del hub."""
+        if self.connection_state_observable.value != ConnectionState.CONNECTED:
+            raise RuntimeError("not connected")
+        await self.download_user_program(mpy)
+
+    async def run_source(self, source, wait: bool = True, print_output: bool = False,
+                         line_handler: bool = True, trace=NULL_TRACE) -> None:
+        """Como PybricksHub.run, pero a partir del código fuente en memoria."""
+        if self.connection_state_observable.value != ConnectionState.CONNECTED:
+            raise RuntimeError("not connected")
+
+        abi = hub_mpy_abi(self)
+        if abi is None:
+            # La descarga heredada (perfil < 1.2.0) sólo acepta rutas: último recurso con temporal
+            await self._run_source_via_tempfile(source, wait, print_output, line_handler, trace)
+            return
+
+        with trace.stage('mpy-cross'):
+            mpy = await compile_source(source, abi)
+
+        # Reiniciar buffers de salida igual que PybricksHub.run
+        self.log_file = None
+        self.output = []
+        self._stdout_buf.clear()
+        self._stdout_line_queue = asyncio.Queue()
+        self.print_output = print_output
+        self._enable_line_handler = line_handler
+        self.script_dir = os.getcwd()
+
+        with trace.stage('descarga'):
+            await self.download_bytes(mpy)
+        with trace.stage('start_user_program'):
+            await self.start_user_program()
+
+        if wait:
+            with trace.stage('espera_fin'):
+                await self._wait_for_user_program_stop()
+
+    async def _run_source_via_tempfile(self, source, wait, print_output, line_handler, trace=NULL_TRACE):
+        if isinstance(source, (bytes, bytearray)):
+            source = bytes(source).decode('utf-8')
+        temp_path = os.path.join(tempfile.gettempdir(), f'spike_program_{id(source)}.py')
+        try:
+            with trace.stage('archivo_temporal'):
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(source)
+            # PybricksHub.run compila, descarga, inicia y espera sin puntos intermedios
+            with trace.stage('run_heredado'):
+                await self.run(temp_path, wait=wait, print_output=print_output, line_handler=line_handler)
+        finally:
+            try:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+            except Exception:
+                pass
+
+class SpikeHubBLE(SpikeHubMixin, PybricksHubBLE):
+    def _command_write_without_response(self) -> bool:
+        try:
+            char = self._client.services.get_characteristic(PYBRICKS_COMMAND_EVENT_UUID)
+        except Exception:
+            return False
+        return char is not None and 'write-without-response' in char.properties
+
+# -------------------- Hub simulado (modo sin conexión) --------------------
+# Un hub Pybricks dentro del propio proceso, hermano de PybricksHubBLE/PybricksHubUSB: implementa
+# read_gatt_char, write_gatt_char y start_notify sobre un enlace con latencia, jitter, MTU y
+# pérdida de paquetes configurables, y responde con STATUS_REPORT y WRITE_STDOUT como el firmware.
+# Sirve para probar y perfilar todo el camino (worker, caché, streaming, telemetría)
+# en un equipo sin Bluetooth. El MPY descargado no se ejecuta: el tipo de programa se reconoce
+# por sus nombres (qstr, que el MPY guarda en claro) y se emula su comportamiento.
+
+SIMULATOR_DEFAULTS = {
+    'latency': 0.0075,      # s por sentido (medio intervalo de conexión de 15 ms)
+    'jitter': 0.0025,       # s, uniforme ±
+    'mtu': 161,             # ATT MTU; cada escritura admite mtu - 3 bytes
+    'loss': 0.0,            # probabilidad de que un paquete se pierda y se retransmita
+    'program_time': 0.3,    # s que dura un programa por orden (su wait(300) final)
+}
+SIMULATOR_MAX_PROGRAM_SIZE = 256 * 1024
+SIMULATOR_STATUS_INTERVAL = 0.5
+SIMULATOR_BATTERY_MV = 8200
+
+class SimulatedHub(SpikeHubMixin, PybricksHub):
+    """Hub SPIKE Prime simulado con el protocolo GATT de Pybricks (perfil 1.3.0)."""
+
+    # Nombres que sólo aparecen en el programa residente y en los programas con latido
+    RESIDENT_MARKER = b'send_telemetry'
+    HOLD_MARKER = b'watchdog'
+
+    def __init__(self, address: str = 'SIM:01', name: str = 'Hub simulado', latency: float = 0.0075,
+                 jitter: float = 0.0025, mtu: int = 161, loss: float = 0.0, program_time: float = 0.3,
+                 hold_timeout: float = WATCHDOG_TIMEOUT):
+        super().__init__()
+        self._device = BLEDevice(address, name, None)
+        self.latency = latency
+        self.jitter = jitter
+        self.mtu = mtu
+        self.loss = min(max(loss, 0.0), 0.9)
+        self.program_time = program_time
+        # Plazo de los programas con latido (el del MPY no se lee: se usa el mismo que el worker)
+        self.hold_timeout = hold_timeout
+        self.watchdog_trips = 0
+        # Contadores del enlace (en ambos sentidos)
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retransmissions = 0
+        self._gatt = {
+            FW_REV_UUID: b'3.3.0',
+            SW_REV_UUID: b'1.3.0',
+            PNP_ID_UUID: struct.pack('<BHHH', 1, 0x0397, HubKind.TECHNIC_LARGE, 0),
+            PYBRICKS_HUB_CAPABILITIES_UUID: struct.pack(
+                '<HII', mtu - 3, HubCapabilityFlag.USER_PROG_MULTI_FILE_MPY6, SIMULATOR_MAX_PROGRAM_SIZE),
+        }
+        self._notify_callbacks = {}
+        self._link_up = False
+        # Cada conexión invalida los paquetes y temporizadores de la anterior
+        self._generation = 0
+        self._reset_hub()
+
+    def _reset_hub(self):
+        self._ram = bytearray()
+        self._program_size = 0
+        self._running = False
+        self._kind = None
+        self._program_timer = None
+        self._telemetry_timer = None
+        self._watchdog_timer = None
+        self._last_at = {'down': 0.0, 'up': 0.0}
+        self._stdin_buf = bytearray()
+        self._resident = [None, None, 0, 0]
+        self._telemetry_seq = 0
+        self._motors = {port: [0.0, 0] for port in 'ACE'}
+        self._claw_target = None
+        self._motors_at = time.monotonic()
+
+    def _call_later(self, delay: float, callback, *args):
+        loop = asyncio.get_running_loop()
+        return loop.call_later(delay, self._if_connected, self._generation, callback, *args)
+
+    # Enlace: cada paquete llega tras latency ± jitter (más una retransmisión por pérdida),
+    # sin adelantar a los anteriores en el mismo sentido (el enlace BLE entrega en orden)
+    def _link_delay(self) -> float:
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        while random.random() < self.loss:
+            self.retransmissions += 1
+            delay += 2 * self.latency
+        return max(0.0, delay)
+
+    def _deliver(self, direction: str, callback, *args) -> float:
+        loop = asyncio.get_running_loop()
+        at = max(loop.time() + self._link_delay(), self._last_at[direction])
+        self._last_at[direction] = at
+        loop.call_at(at, self._if_connected, self._generation, callback, *args)
+        return at
+
+    def _if_connected(self, generation: int, callback, *args):
+        if self._link_up and generation == self._generation:
+            callback(*args)
+
+    async def _client_connect(self) -> bool:
+        self._reset_hub()
+        # Establecimiento del enlace y descubrimiento de servicios: unos intervalos de conexión
+        await asyncio.sleep(4 * self.latency)
+        self._link_up = True
+        self._generation += 1
+        self.fw_version = Version((await self.read_gatt_char(FW_REV_UUID)).decode())
+        _, _, self.hub_kind, self.hub_variant = unpack_pnp_id(await self.read_gatt_char(PNP_ID_UUID))
+        (
+            self._max_write_size,
+            self._capability_flags,
+            self._max_user_program_size,
+            self._num_of_slots,
+        ) = unpack_hub_capabilities(await self.read_gatt_char(PYBRICKS_HUB_CAPABILITIES_UUID))
+        self._schedule_status()
+        return True
+
+    async def _client_disconnect(self) -> bool:
+        self.drop_link()
+        return True
+
+    def drop_link(self):
+        """Corta el enlace como si el hub se apagara o saliera de alcance."""
+        was_up = self._link_up
+        self._link_up = False
+        self._generation += 1
+        self._notify_callbacks = {}
+        if was_up:
+            self._handle_disconnect()
+
+    async def read_gatt_char(self, uuid: str) -> bytearray:
+        await asyncio.sleep(2 * self._link_delay())
+        return bytearray(self._gatt.get(uuid, b''))
+
+    async def start_notify(self, uuid: str, callback) -> None:
+        self._notify_callbacks[uuid] = callback
+        if uuid == PYBRICKS_COMMAND_EVENT_UUID:
+            # El firmware informa del estado en cuanto se activan las notificaciones
+            self._send_status()
+
+    async def write_gatt_char(self, uuid: str, data, response: bool) -> None:
+        if not self._link_up:
+            raise HubDisconnectError("hub simulado desconectado")
+        data = bytes(data)
+        if len(data) > self.mtu - 3:
+            raise ValueError(f"escritura de {len(data)} bytes, el MTU admite {self.mtu - 3}")
+        self.packets_sent += 1
+        self.bytes_sent += len(data)
+        at = self._deliver('down', self._receive, uuid, data)
+        if response:
+            # La confirmación ATT vuelve por el enlace tras procesar la escritura
+            loop = asyncio.get_running_loop()
+            await asyncio.sleep(at - loop.time() + self._link_delay())
+        else:
+            await asyncio.sleep(0)
+
+    def _notify(self, data: bytes):
+        callback = self._notify_callbacks.get(PYBRICKS_COMMAND_EVENT_UUID)
+        if callback is None:
+            return
+        self.packets_received += 1
+        self.bytes_received += len(data)
+        self._deliver('up', callback, 0, data)
+
+    def _send_status(self):
+        flags = StatusFlag.USER_PROGRAM_RUNNING if self._running else StatusFlag(0)
+        self._notify(struct.pack('<BI', Event.STATUS_REPORT, flags))
+
+    def _schedule_status(self):
+        # Informe periódico de estado, como el firmware
+        self._send_status()
+        self._call_later(SIMULATOR_STATUS_INTERVAL, self._schedule_status)
+
+    def _write_stdout(self, data: bytes):
+        for part in chunk(data, self.mtu - 4):
+            self._notify(bytes([Event.WRITE_STDOUT]) + part)
+
+    # Firmware: órdenes recibidas por el servicio Pybricks
+    def _receive(self, uuid: str, data: bytes):
+        if uuid != PYBRICKS_COMMAND_EVENT_UUID or not data:
+            return
+        op = data[0]
+        if op == Command.WRITE_USER_PROGRAM_META:
+            (self._program_size,) = struct.unpack_from('<I', data, 1)
+        elif op == Command.COMMAND_WRITE_USER_RAM:
+            (offset,) = struct.unpack_from('<I', data, 1)
+            payload = data[5:]
+            if len(self._ram) < offset + len(payload):
+                self._ram.extend(bytes(offset + len(payload) - len(self._ram)))
+            self._ram[offset:offset + len(payload)] = payload
+        elif op == Command.START_USER_PROGRAM:
+            self._start_program()
+        elif op == Command.STOP_USER_PROGRAM:
+            self._stop_program()
+        elif op == Command.WRITE_STDIN:
+            self._feed_stdin(data[1:])
+
+    def _start_program(self):
+        if self._running or not self._program_size:
+            return
+        program = bytes(self._ram[:self._program_size])
+        self._running = True
+        self._stdin_buf.clear()
+        if self.RESIDENT_MARKER in program:
+            # Intérprete residente: no termina; [drive, claw, periodo de telemetría en ms]
+            self._kind = 'resident'
+            self._resident = [None, None, 0, 0]
+        elif self.HOLD_MARKER in program:
+            # Programa por orden con latido: sigue mientras lleguen bytes por stdin
+            self._kind = 'hold'
+            self._program_timer = self._call_later(self.hold_timeout, self._stop_program)
+        else:
+            self._kind = 'program'
+            self._program_timer = self._call_later(self.program_time, self._stop_program)
+        self._send_status()
+
+    def _stop_program(self):
+        if not self._running:
+            return
+        for timer in (self._program_timer, self._telemetry_timer, self._watchdog_timer):
+            if timer is not None:
+                timer.cancel()
+        self._program_timer = self._telemetry_timer = self._watchdog_timer = None
+        self._advance_motors()
+        # Al terminar el programa el firmware detiene todos los motores
+        for motor in self._motors.values():
+            motor[1] = 0
+        self._claw_target = None
+        self._running = False
+        self._kind = None
+        self._send_status()
+
+    def _feed_stdin(self, data: bytes):
+        if not self._running:
+            return
+        if self._kind == 'hold':
+            self._program_timer.cancel()
+            self._program_timer = self._call_later(self.hold_timeout, self._stop_program)
+        elif self._kind == 'resident':
+            self._stdin_buf.extend(data)
+            while True:
+                end = self._stdin_buf.find(b'\n')
+                if end < 0:
+                    break
+                line = self._stdin_buf[:end].decode('ascii', 'replace')
+                del self._stdin_buf[:end + 1]
+                try:
+                    self._apply_line(line)
+                except (ValueError, IndexError):
+                    pass
+                # Cada línea es un latido para el perro guardián
+                if self._watchdog_timer is not None:
+                    self._watchdog_timer.cancel()
+                    self._watchdog_timer = None
+                if self._resident[3]:
+                    self._watchdog_timer = self._call_later(self._resident[3] / 1000, self._watchdog_trip)
+
+    def _apply_line(self, line: str):
+        # Mismo protocolo que create_resident_program
+        if not line:
+            return
+        self._advance_motors()
+        op, state = line[0], self._resident
+        if op == 'V':
+            speed_a, _, speed_c = line[1:].partition(',')
+            self._motors['A'][1], self._motors['C'][1] = int(speed_a), int(speed_c)
+            state[0] = None
+        elif op == 'D' and len(line) >= 2:
+            self._drive(int(line[1]))
+        elif op == 'C' and len(line) >= 2:
+            self._claw(int(line[1]))
+        elif op == 'W':
+            state[3] = int(line[1:])
+        elif op == 'T':
+            state[2] = int(line[1:])
+            if self._telemetry_timer is not None:
+                self._telemetry_timer.cancel()
+                self._telemetry_timer = None
+            if state[2]:
+                self._telemetry_timer = self._call_later(state[2] / 1000, self._telemetry_tick)
+        elif op == 'M' and len(line) >= 3:
+            self._drive(int(line[1]))
+            self._claw(int(line[2]))
+
+    def _watchdog_trip(self):
+        self._watchdog_timer = None
+        self._advance_motors()
+        for motor in self._motors.values():
+            motor[1] = 0
+        self._claw_target = None
+        self._resident[0] = DRIVE_INDEX['stop']
+        self._resident[1] = CLAW_INDEX['stop']
+        self.watchdog_trips += 1
+
+    def _drive(self, index: int):
+        if index != self._resident[0]:
+            spec = dict(tuple(DRIVE_COMMANDS.values())[index])
+            self._motors['A'][1], self._motors['C'][1] = spec.get('A', 0), spec.get('C', 0)
+            self._resident[0] = index
+
+    def _claw(self, index: int):
+        if index == self._resident[1]:
+            return
+        name, spec = tuple(CLAW_COMMANDS.items())[index]
+        motor = self._motors['E']
+        if spec is None:
+            motor[1] = 0
+            self._claw_target = None
+        else:
+            speed, angle = spec
+            target = angle if name in CLAW_ABSOLUTE else motor[0] + angle
+            motor[1] = speed if target > motor[0] else -speed if target < motor[0] else 0
+            self._claw_target = target if motor[1] else None
+        self._resident[1] = index
+
+    def _advance_motors(self):
+        now = time.monotonic()
+        dt, self._motors_at = now - self._motors_at, now
+        for motor in self._motors.values():
+            motor[0] += motor[1] * dt
+        target, motor = self._claw_target, self._motors['E']
+        if target is not None and (motor[1] > 0) == (motor[0] >= target):
+            # run_target: la garra se detiene al llegar al ángulo
+            motor[0], motor[1] = target, 0
+            self._claw_target = None
+        if not CLAW_OPEN <= motor[0] <= CLAW_CLOSED:
+            # Tope mecánico: la garra se atasca y claw_guard la detiene
+            motor[0], motor[1] = min(max(motor[0], CLAW_OPEN), CLAW_CLOSED), 0
+            self._claw_target = None
+
+    def _telemetry_tick(self):
+        period = self._resident[2]
+        self._advance_motors()
+        motors = self._motors
+        self._telemetry_seq = (self._telemetry_seq + 1) & 0xFF
+        frame = TELEMETRY_STRUCT.pack(
+            TELEMETRY_SYNC, self._telemetry_seq, int(time.monotonic() * 1000) & 0xFFFF,
+            int(motors['A'][0]), motors['A'][1], 0,
+            int(motors['C'][0]), motors['C'][1], 0,
+            int(motors['E'][0]), motors['E'][1], 0,
+            SIMULATOR_BATTERY_MV, 0, 0, 0,
+        )
+        self._write_stdout(frame + bytes((sum(frame) & 0xFF,)))
+        self._telemetry_timer = self._call_later(period / 1000, self._telemetry_tick)
+
+# -------------------- Caché de programas compilados (MPY en memoria) --------------------
+
+class ProgramCache:
+    """Programas de create_program ya compilados, indexados por (drive, claw, ABI, flags del hub)."""
+    def __init__(self):
+        self._blobs = {}
+        self._prime_task = None
+        self._prime_key = None
+        self.compilations = 0
+
+    @staticmethod
+    def hub_key(hub: SpikeHubBLE):
+        return (hub_mpy_abi(hub), int(hub._capability_flags))
+
+    def supported(self, hub: SpikeHubBLE) -> bool:
+        return hub_mpy_abi(hub) is not None
+
+    def get(self, hub: SpikeHubBLE, drive_cmd: str, claw_cmd: str, hold_ms: int = 0) -> Optional[bytes]:
+        return self._blobs.get((drive_cmd, claw_cmd, hold_ms) + self.hub_key(hub))
+
+    async def compile(self, hub: SpikeHubBLE, drive_cmd: str, claw_cmd: str, hold_ms: int = 0) -> bytes:
+        return await self._compile(drive_cmd, claw_cmd, self.hub_key(hub), hold_ms)
+
+    async def _compile(self, drive_cmd: str, claw_cmd: str, hub_key, hold_ms: int = 0) -> bytes:
+        key = (drive_cmd, claw_cmd, hold_ms) + hub_key
+        blob = self._blobs.get(key)
+        if blob is None:
+            blob = await compile_source(create_program(drive_cmd, claw_cmd, hold_ms), hub_key[0])
+            self.compilations += 1
+            self._blobs[key] = blob
+        return blob
+
+    def prime(self, hub: Optional[SpikeHubBLE], log_cb=None, hub_key=None, hold_ms: int = 0):
+        """Compila en segundo plano toda la matriz drive x claw para el hub conectado.
+
+        Con hub_key = (ABI, flags) recordados de la sesión anterior puede empezar antes de conectar.
+        Con hold_ms también se compila la matriz de programas perpetuos con ese plazo.
+        """
+        if hub_key is None:
+            hub_key = self.hub_key(hub)
+        if hub_key[0] is None:
+            return None
+        holds = (0, hold_ms) if hold_ms else (0,)
+        loop = asyncio.get_running_loop()
+        task = self._prime_task
+        if (self._prime_key == (hub_key, holds) and task is not None and not task.done()
+                and task.get_loop() is loop):
+            return task
+        # Tarea terminada, cancelada por una desconexión o de un loop anterior: volver a lanzarla
+        # (lo ya compilado sigue en _blobs, así que sólo compila lo que falte)
+
+        async def run():
+            try:
+                for hold in holds:
+                    for drive_cmd in DRIVE_COMMANDS:
+                        for claw_cmd in CLAW_COMMANDS:
+                            await self._compile(drive_cmd, claw_cmd, hub_key, hold)
+                if log_cb:
+                    count = len(holds) * len(DRIVE_COMMANDS) * len(CLAW_COMMANDS)
+                    log_cb(f"Caché de programas lista ({count} variantes).")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if log_cb:
+                    log_cb(f"Error precompilando programas: {e}")
+
+        self._prime_key = (hub_key, holds)
+        self._prime_task = loop.create_task(run())
+        return self._prime_task
+
+# -------------------- Ejecución preventiva (no bloqueante) --------------------
+
+class ProgramTracker:
+    """Sigue si hay un programa de usuario en marcha a partir de status_observable, sin esperar."""
+    def __init__(self, hub: SpikeHubBLE):
+        self.running = False
+        self.command = None
+        self._hub = hub
+        self._subscription = hub.status_observable.subscribe(self._on_status)
+
+    def _on_status(self, flags):
+        running = bool(flags & StatusFlag.USER_PROGRAM_RUNNING)
+        if running == self.running:
+            return
+        self.running = running
+        if not running:
+            self.command = None
+
+    def started(self, command):
+        # Se marca en marcha de inmediato: el informe de estado del hub puede llegar después
+        self.command = command
+        self.running = True
+
+    async def stop(self, timeout: float = 0.5) -> bool:
+        """Detiene el programa en curso y espera a que el hub informe que ya no corre."""
+        stopped = asyncio.Event()
+
+        def on_status(flags):
+            if not flags & StatusFlag.USER_PROGRAM_RUNNING:
+                stopped.set()
+
+        # Suscripción antes de enviar STOP para no perder la transición. status_observable
+        # entrega además el valor actual, así que si el programa ya terminó no se espera nada
+        subscription = self._hub.status_observable.subscribe(on_status)
+        try:
+            await self._hub.stop_user_program()
+            await asyncio.wait_for(stopped.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            subscription.dispose()
+            self.running = False
+            self.command = None
+
+    def dispose(self):
+        self._subscription.dispose()
+
+async def execute_command(hub: SpikeHubBLE, drive_cmd: str, claw_cmd: str, log_cb=None,
+                          cache: Optional[ProgramCache] = None,
+                          tracker: Optional[ProgramTracker] = None,
+                          trace=NULL_TRACE,
+                          hold_ms: int = 0) -> bool:
+    """Ejecuta la orden en el hub. Devuelve False si falló (el error ya se registró)."""
+    # Con tracker la ejecución es preventiva: se detiene el programa anterior y no se espera
+    # a que termine el nuevo (su fin se sigue por status_observable).
+    # hold_ms: el programa sigue en marcha mientras reciba latidos (ver _hold_code).
+    wait = tracker is None
     try:
-        with open(temp_path, 'w', encoding='utf-8') as f:
-            f.write(program)
-        
-        # Verificar PATH si está empaquetado (para debug)
-        if getattr(sys, 'frozen', False) and log_cb:
-            path_dirs = os.environ.get('PATH', '').split(os.pathsep)
-            mpy_found = any('mpy' in d.lower() for d in path_dirs)
-            if not mpy_found:
-                log_cb("Advertencia: mpy-cross no encontrado en PATH")
-        
-        await hub.run(temp_path, wait=True, print_output=False)
+        _check_mpy_cross_path(log_cb)
+        if tracker is not None and tracker.running:
+            with trace.stage('parar_anterior'):
+                await tracker.stop()
+        if cache is not None and cache.supported(hub):
+            # Caché en memoria: se descarga el MPY directamente, sin archivo temporal ni mpy-cross
+            blob = cache.get(hub, drive_cmd, claw_cmd, hold_ms)
+            if blob is None:
+                with trace.stage('mpy-cross'):
+                    blob = await cache.compile(hub, drive_cmd, claw_cmd, hold_ms)
+            with trace.stage('descarga'):
+                await hub.download_bytes(blob)
+            with trace.stage('start_user_program'):
+                await hub.start_user_program()
+            if wait:
+                with trace.stage('espera_fin'):
+                    await hub._wait_for_user_program_stop()
+        else:
+            with trace.stage('create_program'):
+                source = create_program(drive_cmd, claw_cmd, hold_ms)
+            await hub.run_source(source, wait=wait, trace=trace)
+        if tracker is not None:
+            tracker.started((drive_cmd, claw_cmd, hold_ms))
         if log_cb:
             log_cb(f"Ejecutado: drive={drive_cmd}, claw={claw_cmd}")
+        return True
     except FileNotFoundError as e:
         if log_cb:
             log_cb(f"Error: No se encuentra mpy-cross.exe. PATH: {os.environ.get('PATH', '')[:200]}")
     except Exception as e:
         if log_cb:
             log_cb(f"Error ejecutando comandos: {e}")
-    finally:
+    return False
+
+# -------------------- Modo streaming: control desde el host --------------------
+
+async def start_resident_program(hub: SpikeHubBLE, log_cb=None) -> bool:
+    """Descarga e inicia el intérprete residente. Devuelve False si no se pudo iniciar."""
+    try:
+        _check_mpy_cross_path(log_cb)
+        # Sin manejador de líneas: el stdout del residente lleva tramas binarias de telemetría
+        await hub.run_source(create_resident_program(), wait=False, line_handler=False)
+        if await wait_for_user_program_running(hub):
+            return True
+        if log_cb:
+            log_cb("El programa residente no llegó a iniciarse en el hub.")
+        return False
+    except FileNotFoundError:
+        if log_cb:
+            log_cb(f"Error: No se encuentra mpy-cross.exe. PATH: {os.environ.get('PATH', '')[:200]}")
+    except Exception as e:
+        if log_cb:
+            log_cb(f"Error iniciando programa residente: {e}")
+    return False
+
+def resident_program_running(hub: SpikeHubBLE) -> bool:
+    return bool(hub.status_observable.value & StatusFlag.USER_PROGRAM_RUNNING)
+
+async def wait_for_user_program_running(hub: SpikeHubBLE, timeout: float = 1.0) -> bool:
+    started = asyncio.Event()
+
+    def on_status(flags):
+        if flags & StatusFlag.USER_PROGRAM_RUNNING:
+            started.set()
+
+    # status_observable es un BehaviorSubject: entrega el estado actual al suscribirse
+    with hub.status_observable.subscribe(on_status):
         try:
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-        except Exception:
-            pass
+            await asyncio.wait_for(started.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+async def send_stream_line(hub: SpikeHubBLE, line: bytes, log_cb=None):
+    try:
+        await hub.write(line)
+    except Exception as e:
+        if log_cb:
+            log_cb(f"Error enviando comandos: {e}")
+
+async def send_streaming_command(hub: SpikeHubBLE, drive_cmd: str, claw_cmd: str, log_cb=None,
+                                 line: Optional[bytes] = None):
+    try:
+        await hub.write(line or encode_stream_command(drive_cmd, claw_cmd))
+        if log_cb:
+            log_cb(f"Enviado: drive={drive_cmd}, claw={claw_cmd}")
+    except Exception as e:
+        if log_cb:
+            log_cb(f"Error enviando comandos: {e}")
+
+# -------------------- Hub recordado (reconexión rápida) --------------------
+
+# Tiempo máximo esperando el anuncio del último hub antes de escanear cualquier hub
+REMEMBERED_HUB_TIMEOUT = 2.0
+
+def remember_hub(hub: SpikeHubBLE):
+    device = hub._device
+    settings = load_settings()
+    settings['last_hub'] = {
+        'address': device.address,
+        'name': device.name,
+        'capability_flags': int(hub._capability_flags),
+        'max_write_size': hub._max_write_size,
+        'num_of_slots': hub._num_of_slots,
+    }
+    save_settings(settings)
 
 # -------------------- Worker BLE asíncrono en hilo dedicado --------------------
 
+# Tick bajo demanda: reenvío del perpetuo sin perro guardián, intervalo mínimo entre latidos
+# y suavizado del retardo de envío medido (adapta los latidos a la calidad del enlace)
+TICK_RESEND_INTERVAL = 0.25
+TICK_MIN_INTERVAL = 0.05
+LINK_DELAY_SMOOTHING = 0.2
+
+# Espera entre reintentos de reconexión (se duplica en cada fallo, con jitter ±50 %)
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 8.0
+
+# Modo flota: enlaces LE simultáneos que admite un adaptador típico (Windows/Intel ~7)
+FLEET_MAX_HUBS = 7
+FLEET_SCAN_TIMEOUT = 10.0
+# Destino especial que reparte cada orden a todos los hubs conectados
+TARGET_ALL = 'todos'
+
+async def discover_hubs(count: int, timeout: float = FLEET_SCAN_TIMEOUT) -> list:
+    """Un único escaneo que devuelve hasta count hubs Pybricks distintos."""
+    found = {}
+    done = asyncio.Event()
+
+    def on_detect(device, adv):
+        if PYBRICKS_SERVICE_UUID not in adv.service_uuids or adv.local_name is None:
+            return
+        found.setdefault(device.address, device)
+        if len(found) >= count:
+            done.set()
+
+    async with BleakScanner(on_detect, service_uuids=[PYBRICKS_SERVICE_UUID]):
+        try:
+            await asyncio.wait_for(done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    return list(found.values())[:count]
+
+class InputRecorder:
+    """Graba cada fotograma de entrada del worker con su instante, para reproducirlo después.
+
+    Formato JSON Lines: {"t": s, "source": …} más "keys" (lista de teclas), "perpetual" y
+    "speeds" como en apply_input, o "key"/"down" como en set_key. Se escribe al desconectar.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.frames = []
+        self._start = time.perf_counter()
+
+    def record(self, **frame):
+        if 'keys' in frame and frame['keys'] is not None:
+            frame['keys'] = [key for key in INPUT_KEYS if frame['keys'] & KEY_BIT[key]]
+        frame = {k: v for k, v in frame.items() if v is not None}
+        frame['t'] = round(time.perf_counter() - self._start, 4)
+        self.frames.append(frame)
+
+    def save(self, log_cb=None):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                for frame in self.frames:
+                    f.write(json.dumps(frame) + "\n")
+            if log_cb:
+                log_cb(f"Entrada grabada en {self.path} ({len(self.frames)} fotogramas).")
+        except OSError as e:
+            if log_cb:
+                log_cb(f"No se pudo guardar la grabación de entrada: {e}")
+
+# Margen (s) sobre la duración nominal de un movimiento de garra antes de darlo por terminado, y
+# distancia (grados) a la que la garra ya se considera en su destino
+CLAW_MARGIN = 0.3
+CLAW_TOLERANCE = 15
+
+class ClawMirror:
+    """Modelo en el host de la garra: ángulo del motor E (el mismo que usan los programas del hub).
+
+    Integra los movimientos enviados a su velocidad nominal y, si hay telemetría, se corrige con el
+    ángulo medido. Sirve para descartar antes de la cola BLE las órdenes de garra que no cambiarían
+    nada: abrir o cerrar una garra que ya está en esa posición (o yendo hacia ella).
+    """
+    def __init__(self):
+        self.position = None  # ángulo estimado; None = desconocido
+        self.move = None      # (ángulo inicial, destino, velocidad, inicio, fin) del movimiento en curso
+        self._frames = 0
+
+    def estimate(self, now: float) -> Optional[float]:
+        if self.move is None:
+            return self.position
+        start, target, speed, since, end = self.move
+        if now >= end:
+            return target
+        if start is None or target is None:
+            return None
+        step = speed * (now - since)
+        return min(target, start + step) if target >= start else max(target, start - step)
+
+    def moving(self, now: float) -> bool:
+        return self.move is not None and now < self.move[4]
+
+    def issue(self, claw_cmd: str, now: float):
+        """Registra una orden de garra que ya salió hacia el hub."""
+        start = self.estimate(now)
+        spec = CLAW_COMMANDS.get(claw_cmd)
+        self.position, self.move = start, None
+        if spec is None:
+            return
+        speed, angle = spec
+        if claw_cmd in CLAW_ABSOLUTE:
+            target = angle
+        elif start is not None:
+            target = min(max(start + angle, CLAW_OPEN), CLAW_CLOSED)
+        else:
+            target = None
+        if start is not None and target is not None:
+            travel = abs(target - start)
+        else:
+            travel = abs(angle) if claw_cmd not in CLAW_ABSOLUTE else CLAW_CLOSED - CLAW_OPEN
+        self.move = (start, target, speed, now, now + travel / speed + CLAW_MARGIN)
+
+    def observe(self, decoder: 'TelemetryDecoder', now: float):
+        # Con telemetría nueva manda el ángulo medido; el movimiento acaba cuando el motor se para
+        if decoder.frames == self._frames:
+            return
+        self._frames = decoder.frames
+        sample = decoder.latest()
+        self.position = sample['e_angle']
+        if self.move is None:
+            return
+        _, target, speed, since, _ = self.move
+        if sample['e_speed'] == 0 and now - since > CLAW_MARGIN:
+            self.move = None
+        elif target is not None:
+            self.move = (self.position, target, speed, now,
+                         now + abs(target - self.position) / speed + CLAW_MARGIN)
+
+    def redundant(self, claw_cmd: str, now: float) -> bool:
+        """True si la orden no cambiaría el estado de la garra (sólo destinos absolutos)."""
+        if claw_cmd not in CLAW_ABSOLUTE:
+            # Los ajustes relativos siempre mueven la garra y parar nunca sobra
+            return False
+        target = CLAW_COMMANDS[claw_cmd][1]
+        if self.moving(now):
+            return self.move[1] == target
+        position = self.estimate(now)
+        return position is not None and abs(position - target) <= CLAW_TOLERANCE
+
+    def filter(self, state: dict, last_state: dict, now: float) -> bool:
+        """Descarta de state la orden de garra si no la cambiaría; devuelve True si la descartó.
+
+        Sólo tras una garra parada: una orden absoluta cuyo destino ya alcanzó se anota con su
+        estado real (parada), así soltar la tecla o cambiar la conducción no la repite. Parar y
+        los ajustes relativos nunca son redundantes (ver redundant).
+        """
+        if last_state['claw'] != 'stop' or not self.redundant(state['claw'], now):
+            return False
+        state['claw'] = 'stop'
+        return True
+
+class HubSession:
+    """Estado de un hub dentro del worker: teclas, perpetuo, último envío y su supervisor.
+
+    Cada sesión tiene su propio evento de despertar (su cola de órdenes "el último gana"),
+    así un hub lento o reconectando no retrasa a los demás hubs de la flota.
+    """
+    def __init__(self, worker: 'BLEWorker', hub: SpikeHubBLE, name: str, address: Optional[str] = None):
+        self.worker = worker
+        self.hub = hub
+        self.name = name
+        self.address = address
+        self.prefix = ''
+        self.wakeup = asyncio.Event()
+        self.tick_pending = False
+        # Próximo tick de esta sesión en el reloj del loop (None = no necesita ticks)
+        self.next_tick = None
+        # Tiempo medio (EWMA, s) que tarda en salir un envío: con el enlace lento los latidos se adelantan
+        self.link_delay = 0.0
+        # Máscara de teclas pulsadas por fuente de entrada ('gui', 'gamepad'…); keys es su OR
+        self.inputs = {}
+        self.keys = 0
+        self.last_state = {'drive': None, 'claw': None, 'speeds': None}
+        self.perpetual = {'drive': None, 'claw': None}
+        # Consigna analógica (velocidad A, velocidad C); (0, 0) = mandan las teclas
+        self.speeds = (0, 0)
+        self._speeds_sent_at = 0.0
+        # Traza del cambio de entrada aún no enviado (los cambios que llegan antes se colapsan en ella)
+        self.trace = None
+        # Telemetría (sólo con programa residente): periodo ya enviado al hub y suscripción a stdout
+        self.telemetry = TelemetryDecoder()
+        self._telemetry_rate = None
+        self._stdout_subscription = None
+        # Plazo del perro guardián ya enviado al programa residente
+        self._watchdog_sent = None
+        # Modelo de la garra: las órdenes que no la cambiarían no llegan a enviarse
+        self.claw = ClawMirror()
+        self.streaming_active = False
+        self.tracker = None
+        self.state = 'conectado'
+        self.metrics = {
+            'disconnects': 0,
+            'reconnects': 0,
+            'reconnect_attempts': 0,
+            'last_reconnect_s': None,
+            'last_outage_s': None,
+            'total_outage_s': 0.0,
+            'ticks': 0,
+            'idle_ticks': 0,
+            'claw_dropped': 0,
+        }
+
+    def log(self, msg: str):
+        self.worker.log(self.prefix + msg, source=self.name)
+
+    async def setup(self):
+        # Prepara el hub recién conectado: programa residente o caché
+        worker = self.worker
+        if worker.streaming:
+            self.streaming_active = await start_resident_program(self.hub, self.log)
+            if self.streaming_active:
+                self._stdout_subscription = self.hub.stdout_observable.subscribe(self.telemetry.feed)
+                self.log("Modo streaming activo (programa residente).")
+            else:
+                self.log("Modo streaming no disponible; se usa un programa por orden.")
+        if not self.streaming_active:
+            worker.cache.prime(self.hub, self.log, hold_ms=worker.hold_ms)
+        if worker.preemptive:
+            self.tracker = ProgramTracker(self.hub)
+
+    def teardown(self):
+        self.streaming_active = False
+        # Sin programa en marcha la garra se detiene
+        self.claw.issue('stop', time.monotonic())
+        self._telemetry_rate = None
+        self._watchdog_sent = None
+        if self._stdout_subscription is not None:
+            self._stdout_subscription.dispose()
+            self._stdout_subscription = None
+        if self.tracker is not None:
+            self.tracker.dispose()
+            self.tracker = None
+
+    async def run(self):
+        # Supervisor: si el enlace cae, reconectar y reanudar el estado sin intervención
+        try:
+            while True:
+                try:
+                    await self.hub.race_disconnect(self.serve())
+                except HubDisconnectError:
+                    await self.reconnect()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.log(f"Error en worker: {e}")
+        finally:
+            try:
+                await self.hub.disconnect()
+                self.log("Hub desconectado.")
+            except Exception as e:
+                self.log(f"Error al desconectar: {e}")
+            self.state = 'desconectado'
+            self.teardown()
+
+    async def reconnect(self):
+        outage_start = time.monotonic()
+        self.state = 'reconectando'
+        self.metrics['disconnects'] += 1
+        self.log("Conexión perdida; reconectando…")
+        self.teardown()
+
+        delay = RECONNECT_BASE_DELAY
+        attempts = 0
+        while True:
+            attempts += 1
+            self.metrics['reconnect_attempts'] += 1
+            attempt_start = time.monotonic()
+            try:
+                hub = await self.worker._reconnect_hub(self)
+            except Exception as e:
+                self.log(f"Reintento {attempts} fallido: {e}")
+                hub = None
+            if hub is not None:
+                self.hub = hub
+                try:
+                    await self.setup()
+                    break
+                except Exception as e:
+                    # Fallo al preparar el hub (residente, compilación…): cuenta como un intento fallido
+                    self.log(f"Reintento {attempts} fallido al preparar el hub: {e}")
+                    self.teardown()
+                    try:
+                        await hub.disconnect()
+                    except Exception:
+                        pass
+            # Espera exponencial con jitter para no saturar el adaptador ni coincidir con otros hubs
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+        # Reanudar: se vuelve a enviar el estado actual (teclas + perpetuo) al hub nuevo
+        self.last_state = {'drive': None, 'claw': None, 'speeds': None}
+        self.wakeup.set()
+        self.state = 'conectado'
+
+        reconnect_s = time.monotonic() - attempt_start
+        outage_s = time.monotonic() - outage_start
+        self.metrics['reconnects'] += 1
+        self.metrics['last_reconnect_s'] = reconnect_s
+        self.metrics['last_outage_s'] = outage_s
+        self.metrics['total_outage_s'] += outage_s
+        self.log(f"Reconectado en {reconnect_s:.1f} s (intentos: {attempts}, corte total: {outage_s:.1f} s).")
+
+    def tick_interval(self) -> Optional[float]:
+        """Cada cuánto necesita tick esta sesión; None si ahora no lo necesita."""
+        timeout = self.worker.watchdog_timeout
+        if self.streaming_active:
+            # Latidos sólo mientras el hub tenga motores en marcha
+            if not timeout or state_is_idle(self.last_state):
+                return None
+            return self._beat_interval(timeout)
+        if self.perpetual['drive'] is None and self.perpetual['claw'] is None:
+            return None
+        if timeout and self.tracker is not None:
+            return self._beat_interval(timeout)
+        # Sin perro guardián: reenviar el perpetuo cuando termina el programa
+        return TICK_RESEND_INTERVAL
+
+    def _beat_interval(self, timeout: float) -> float:
+        return max(TICK_MIN_INTERVAL, (timeout - 2 * self.link_delay) / WATCHDOG_BEATS)
+
+    async def _send_timed(self, line: bytes):
+        # El latido va con confirmación ATT: hub.write vuelve al vaciarse el búfer local y no mide
+        # el enlace, el ACK sí (ida y vuelta; el retardo hasta el hub es la mitad)
+        start = time.monotonic()
+        try:
+            acked = await self.hub.write_acked(line)
+        except Exception as e:
+            self.log(f"Error enviando comandos: {e}")
+            return
+        if acked:
+            round_trip = time.monotonic() - start
+            self.link_delay += LINK_DELAY_SMOOTHING * (round_trip / 2 - self.link_delay)
+
+    # Cambios de entrada (llamar con worker.lock tomado); devuelven si el estado cambió
+    def set_input(self, source: str, mask: int) -> bool:
+        if self.inputs.get(source, 0) == mask:
+            return False
+        if mask:
+            self.inputs[source] = mask
+        else:
+            self.inputs.pop(source, None)
+        keys = 0
+        for source_mask in self.inputs.values():
+            keys |= source_mask
+        changed = keys != self.keys
+        self.keys = keys
+        return changed
+
+    def set_perpetual(self, overrides: dict) -> bool:
+        perpetual = dict(self.perpetual, **overrides)
+        if perpetual == self.perpetual:
+            return False
+        self.perpetual = perpetual
+        return True
+
+    def set_speeds(self, speeds: tuple) -> bool:
+        speeds = tuple(speeds)
+        if speeds == self.speeds:
+            return False
+        self.speeds = speeds
+        return True
+
+    def release_keys(self) -> bool:
+        changed = bool(self.keys)
+        self.inputs = {}
+        self.keys = 0
+        return changed
+
+    def snapshot(self) -> dict:
+        # Llamar con worker.lock tomado
+        drive_cmd, claw_cmd = COMMAND_TABLE[self.keys]
+        speeds = None
+        if self.speeds != (0, 0):
+            speeds = self.speeds
+            drive_cmd = speeds_to_command(speeds)
+
+        # Sobrescritura por modo perpetuo
+        if self.perpetual['drive'] is not None:
+            drive_cmd = self.perpetual['drive']
+            speeds = None
+        if self.perpetual['claw'] is not None:
+            claw_cmd = self.perpetual['claw']
+
+        return {'drive': drive_cmd, 'claw': claw_cmd, 'speeds': speeds}
+
+    async def stream(self, state: dict) -> bool:
+        """Envía al programa residente sólo lo que cambió respecto a last_state.
+
+        Devuelve False si la consigna analógica quedó aplazada por el límite de frecuencia.
+        """
+        last = self.last_state
+        speeds = state['speeds']
+        if state['claw'] != last['claw']:
+            self.claw.issue(state['claw'], time.monotonic())
+        if speeds is None:
+            await send_streaming_command(self.hub, state['drive'], state['claw'], self.log,
+                                         encode_channel_command(last, state))
+            self.last_state = state
+            return True
+
+        if state['claw'] != last['claw'] or last['speeds'] is None:
+            await send_stream_line(self.hub, encode_claw_command(state['claw']), self.log)
+        if speeds != last['speeds']:
+            loop = asyncio.get_running_loop()
+            delay = self._speeds_sent_at + 1 / self.worker.analog_rate - loop.time()
+            if delay > 0:
+                # Límite de frecuencia: al vencer el plazo se envía la consigna más reciente
+                loop.call_later(delay, self.wakeup.set)
+                self.last_state = dict(state, speeds=last['speeds'], drive=last['drive'])
+                return False
+            await send_stream_line(self.hub, encode_speed_command(speeds), self.log)
+            self._speeds_sent_at = loop.time()
+        self.last_state = state
+        return True
+
+    async def serve(self):
+        worker = self.worker
+        while True:
+            if self.next_tick is None and self.tick_interval() is not None:
+                # Empieza a necesitar ticks: despertar al ticker si estaba parado
+                worker.request_ticks()
+            await self.wakeup.wait()
+            # Todo cambio ocurrido mientras se enviaba la orden anterior se colapsa aquí
+            self.wakeup.clear()
+            tick = self.tick_pending
+            self.tick_pending = False
+            if tick:
+                self.metrics['ticks'] += 1
+
+            if self.streaming_active and not resident_program_running(self.hub):
+                # El programa residente se detuvo (p. ej. botón del hub): relanzarlo
+                self.log("Programa residente detenido; reiniciando…")
+                self.streaming_active = await start_resident_program(self.hub, self.log)
+                self.last_state = {'drive': None, 'claw': None, 'speeds': None}
+                self.claw.issue('stop', time.monotonic())
+                self._telemetry_rate = None
+                self._watchdog_sent = None
+                if not self.streaming_active:
+                    worker.cache.prime(self.hub, self.log, hold_ms=worker.hold_ms)
+
+            # Instantánea del estado más reciente (se toma después de cualquier espera)
+            with worker.lock:
+                current_state = self.snapshot()
+                perpetual = self.perpetual['drive'] is not None or self.perpetual['claw'] is not None
+                trace, self.trace = self.trace or NULL_TRACE, None
+            trace.mark('cola')
+            now = time.monotonic()
+            self.claw.observe(self.telemetry, now)
+            # La garra quieta ya está donde pide la orden: no se envía nada por ella
+            if self.claw.filter(current_state, self.last_state, now) and not tick:
+                self.metrics['claw_dropped'] += 1
+            drive_cmd, claw_cmd = current_state['drive'], current_state['claw']
+
+            if self.streaming_active:
+                if self._watchdog_sent != worker.watchdog_timeout:
+                    self._watchdog_sent = worker.watchdog_timeout
+                    await send_stream_line(self.hub, encode_watchdog_command(worker.watchdog_timeout), self.log)
+                # El hub mantiene los motores en marcha: en cada tick basta un latido mientras se muevan
+                if current_state != self.last_state:
+                    tick = False
+                    with trace.stage('stdin'):
+                        sent = await self.stream(current_state)
+                    if sent:
+                        trace.finish()
+                    else:
+                        with worker.lock:
+                            # Aplazada: la traza sigue abierta hasta el envío, salvo que llegue otra
+                            self.trace = self.trace or trace
+                elif tick and worker.watchdog_timeout and not state_is_idle(current_state):
+                    # Latido: repetir la orden en curso (unos bytes); el hub la aplica sólo si la perdió
+                    tick = False
+                    await self._send_timed(encode_state_command(current_state))
+                if tick:
+                    self.metrics['idle_ticks'] += 1
+                if self._telemetry_rate != worker.telemetry_rate:
+                    self._telemetry_rate = worker.telemetry_rate
+                    await send_stream_line(self.hub, encode_telemetry_command(self._telemetry_rate), self.log)
+                continue
+
+            # Sin programa residente la consigna analógica se aproxima con comandos discretos
+            current_state['speeds'] = None
+
+            # Perpetuo con ejecución preventiva: el programa sigue en marcha mientras reciba latidos
+            hold_ms = worker.hold_ms if perpetual and self.tracker is not None else 0
+            force = tick and perpetual
+            if force and self.tracker is not None and self.tracker.running:
+                # El programa perpetuo anterior sigue en marcha: reenviarlo sólo lo cortaría
+                force = False
+            if force and drive_cmd == 'stop' and self.claw.redundant(claw_cmd, now):
+                # Perpetuo sólo de garra y la garra ya llegó: reenviarlo no la movería
+                force = False
+            if force or current_state != self.last_state:
+                tick = False
+                ok = await execute_command(self.hub, drive_cmd, claw_cmd, self.log, cache=worker.cache,
+                                           tracker=self.tracker, trace=trace,
+                                           hold_ms=hold_ms)
+                if ok:
+                    # Cada programa nuevo vuelve a dar la orden de garra (la anterior se cortó con él)
+                    self.claw.issue(claw_cmd, time.monotonic())
+                self.last_state = current_state
+                trace.finish()
+            elif tick and hold_ms and self.tracker.command == (drive_cmd, claw_cmd, hold_ms):
+                tick = False
+                await self._send_timed(HEARTBEAT)
+            if tick:
+                self.metrics['idle_ticks'] += 1
+
 class BLEWorker:
-    def __init__(self, log_queue: Queue):
+    """Un hilo con un loop asyncio que gestiona uno o varios hubs (modo flota).
+
+    Las órdenes de la GUI y del mando se aplican a los hubs del destino actual
+    (TARGET_ALL, el nombre de un hub o un grupo definido en 'fleet_groups' de la configuración).
+    """
+    def __init__(self, log_queue: Queue, streaming: bool = True, preemptive: bool = True,
+                 fleet_size: int = 1, offline: bool = False):
         self.loop = asyncio.new_event_loop()
         self.thread = threading.Thread(target=self._thread_main, daemon=True)
-        self.queue = None  # se crea dentro del loop
-        self.hub = None
-        self.pressed = set()
+        # Planificador "el último gana" por hub: cada HubSession tiene su evento de despertar y
+        # toma una instantánea del estado al procesarlo, en lugar de acumular órdenes.
+        self.sessions = {}  # nombre del hub -> HubSession
         self.lock = threading.Lock()
-        self.last_state = {'drive': None, 'claw': None}
-        self.perpetual = {'drive': None, 'claw': None}
         self.running = threading.Event()
         self.log_queue = log_queue
-
-    def log(self, msg: str):
-        self.log_queue.put(msg)
+        # streaming: usar el programa residente; si no arranca se vuelve al modo programa-por-orden
+        self.streaming = streaming
+        self.cache = ProgramCache()
+        # preemptive: una orden nueva detiene el programa en curso en vez de esperar a que acabe
+        self.preemptive = preemptive
+        # fleet_size > 1: conectar a varios hubs a la vez y repartir las órdenes según el destino
+        self.fleet_size = fleet_size
+        # offline: hubs simulados en el propio proceso en lugar de Bluetooth (SimulatedHub)
+        self.offline = offline
+        settings = load_settings()
+        # Parámetros del enlace simulado: SIMULATOR_DEFAULTS con lo que indique 'simulator' en ajustes
+        simulator = settings.get('simulator', {})
+        self.simulator = dict(SIMULATOR_DEFAULTS, **{k: v for k, v in simulator.items() if k in SIMULATOR_DEFAULTS})
+        # Grabación de la entrada (JSON Lines) para reproducirla con "benchmarks.py pipeline"
+        self.record_path = settings.get('record_input')
+        self.recorder = None
+        self.groups = settings.get('fleet_groups', {})
+        # Consignas analógicas por segundo y hub como máximo (configurable en el archivo de ajustes)
+        self.analog_rate = float(settings.get('analog_rate', ANALOG_MAX_RATE))
+        # Muestras de telemetría por segundo que emite cada hub (0 = apagada)
+        self.telemetry_rate = 0.0
+        # Plazo (s) del perro guardián del hub; 0 = sin perro (perpetuo por reenvío, como antes)
+        self.watchdog_timeout = float(settings.get('watchdog_timeout', WATCHDOG_TIMEOUT))
+        # Trazas de latencia de cada orden (se conservan entre conexiones)
+        self.tracer = LatencyTracer()
+        self.target = TARGET_ALL
+        self.connect_s = None
+        # Despertares del ticker (sin demanda no se despierta: espera a request_ticks). Sólo cuenta
+        # el ticker: la lectura del mando y el bucle de la GUI tienen sus propios despertares
+        self.ticker_wakeups = 0
+        self._tick_demand = None
+        self._main_task = None
+        self._state = 'desconectado'
+
+    def log(self, msg: str, source: str = 'ble'):
+        self.log_queue.put((source, msg))
+
+    @property
+    def state(self) -> str:
+        # Estado visible de la conexión: 'reconectando' si algún hub de la flota lo está
+        if self._state != 'conectado':
+            return self._state
+        with self.lock:
+            states = [s.state for s in self.sessions.values()]
+        return 'reconectando' if 'reconectando' in states else 'conectado'
+
+    @property
+    def metrics(self) -> dict:
+        # Métricas del supervisor de reconexión sumadas para todos los hubs
+        total = {'disconnects': 0, 'reconnects': 0, 'reconnect_attempts': 0,
+                 'last_reconnect_s': None, 'last_outage_s': None, 'total_outage_s': 0.0,
+                 'ticks': 0, 'idle_ticks': 0, 'claw_dropped': 0,
+                 'ticker_wakeups': self.ticker_wakeups}
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            for key, value in session.metrics.items():
+                if key.startswith('last_'):
+                    total[key] = value if value is not None else total[key]
+                else:
+                    total[key] += value
+        return total
 
     def _thread_main(self):
         asyncio.set_event_loop(self.loop)
-        self.queue = asyncio.Queue()
-        self.loop.create_task(self._runner())
+        self._main_task = self.loop.create_task(self._runner())
         try:
             self.loop.run_forever()
         finally:
@@ -203,111 +2226,446 @@ class BLEWorker:
             for t in pending:
                 t.cancel()
 
-    async def _runner(self):
+    async def _connect_address(self, address: str) -> Optional[SpikeHubBLE]:
+        # Búsqueda filtrada por dirección: termina en cuanto ese hub anuncia (sin escaneo completo
+        # de 10 s) y no se confunde con otros hubs Pybricks cercanos.
+        device = await BleakScanner.find_device_by_address(address, timeout=REMEMBERED_HUB_TIMEOUT)
+        if device is None:
+            return None
+        hub = SpikeHubBLE(device)
+        await hub.connect()
+        return hub
+
+    async def _connect_remembered(self, remembered: dict) -> Optional[SpikeHubBLE]:
+        address = remembered.get('address')
+        if not address:
+            return None
+        self.log(f"Conectando al último hub ({remembered.get('name') or address})…")
         try:
+            hub = await self._connect_address(address)
+            if hub is None:
+                self.log("El último hub no responde; buscando otros hubs…")
+            return hub
+        except Exception as e:
+            self.log(f"No se pudo conectar al último hub ({e}); buscando otros hubs…")
+            return None
+
+    async def _connect_simulated(self, index: int) -> SimulatedHub:
+        hub = SimulatedHub(address=f"SIM:{index:02d}", name=f"Hub simulado {index}",
+                           hold_timeout=self.watchdog_timeout, **self.simulator)
+        await hub.connect()
+        return hub
+
+    async def _connect_hub(self) -> Optional[SpikeHubBLE]:
+        if self.offline:
+            self.log("Modo sin conexión: usando un hub simulado.")
+            return await self._connect_simulated(1)
+        remembered = load_settings().get('last_hub') or {}
+        if remembered and not self.streaming:
+            # Los flags recordados permiten precompilar mientras se conecta
+            self.cache.prime(None, self.log, hub_key=(
+                mpy_abi_from_flags(HubCapabilityFlag(remembered.get('capability_flags', 0))),
+                remembered.get('capability_flags', 0),
+            ), hold_ms=self.hold_ms)
+
+        hub = await self._connect_remembered(remembered) if remembered else None
+        if hub is None:
             self.log("Buscando hub mediante Bluetooth…")
             device = await find_device()
             if not device:
                 self.log("No se ha encontrado hub.")
-                return
+                return None
             name = getattr(device, 'name', str(device))
             self.log(f"Conectando a {name}…")
-            self.hub = PybricksHubBLE(device)
-            await self.hub.connect()
+            hub = SpikeHubBLE(device)
+            await hub.connect()
+        remember_hub(hub)
+        return hub
+
+    async def _connect_fleet(self) -> list:
+        count = min(self.fleet_size, FLEET_MAX_HUBS)
+        if self.offline:
+            self.log(f"Modo sin conexión: usando {count} hubs simulados.")
+            return list(await asyncio.gather(*(self._connect_simulated(i + 1) for i in range(count))))
+        self.log(f"Buscando {count} hubs mediante Bluetooth…")
+        devices = await discover_hubs(count)
+        if not devices:
+            self.log("No se ha encontrado hub.")
+            return []
+        if len(devices) < count:
+            self.log(f"Sólo se encontraron {len(devices)} de {count} hubs.")
+
+        async def connect(device):
+            try:
+                hub = SpikeHubBLE(device)
+                await hub.connect()
+                return hub
+            except Exception as e:
+                self.log(f"No se pudo conectar a {device.name or device.address}: {e}")
+                return None
+
+        # connect() concurrente: el descubrimiento GATT de cada hub se solapa con el de los demás
+        hubs = await asyncio.gather(*(connect(device) for device in devices))
+        return [hub for hub in hubs if hub is not None]
+
+    async def _reconnect_hub(self, session: HubSession) -> Optional[SpikeHubBLE]:
+        # En flota cada sesión vuelve a su propio hub; con un solo hub vale cualquiera
+        if self.offline:
+            return await self._connect_simulated(int((session.address or 'SIM:01')[4:]))
+        if self.fleet_size > 1 and session.address:
+            return await self._connect_address(session.address)
+        return await self._connect_hub()
+
+    def _add_session(self, hub: SpikeHubBLE) -> HubSession:
+        device = getattr(hub, '_device', None)
+        address = getattr(device, 'address', None)
+        name = getattr(device, 'name', None) or address or f"hub{len(self.sessions) + 1}"
+        if name in self.sessions:
+            # Hubs con el mismo nombre (p. ej. el de fábrica): se distinguen por dirección
+            name = f"{name} ({(address or str(len(self.sessions)))[-5:]})"
+        session = HubSession(self, hub, name, address)
+        with self.lock:
+            self.sessions[name] = session
+        return session
+
+    async def _runner(self):
+        if self.record_path:
+            self.recorder = InputRecorder(self.record_path)
+        try:
+            self._state = 'conectando'
+            connect_start = time.monotonic()
+            if self.fleet_size > 1:
+                hubs = await self._connect_fleet()
+            else:
+                hub = await self._connect_hub()
+                hubs = [hub] if hub is not None else []
+            if not hubs:
+                return
+            sessions = [self._add_session(hub) for hub in hubs]
+            if len(sessions) > 1:
+                for session in sessions:
+                    session.prefix = f"[{session.name}] "
+                self.log(f"Conectados {len(sessions)} hubs: {', '.join(s.name for s in sessions)}.")
             self.log("Conectado. Listo para recibir órdenes.")
+            await asyncio.gather(*(session.setup() for session in sessions))
+            self.connect_s = time.monotonic() - connect_start
+            self._state = 'conectado'
             self.running.set()
 
+            self._tick_demand = asyncio.Event()
             asyncio.create_task(self._ticker())
 
-            while True:
-                token = await self.queue.get()
-                with self.lock:
-                    drive_cmd = compute_drive_command(self.pressed)
-                    claw_cmd = 'stop'
-                    if 'x' in self.pressed and 'z' not in self.pressed:
-                        claw_cmd = 'cerrar'
-                    elif 'z' in self.pressed and 'x' not in self.pressed:
-                        claw_cmd = 'abrir'
-                    elif 'm' in self.pressed and 'n' not in self.pressed:
-                        claw_cmd = 'cerrar_lento'
-                    elif 'n' in self.pressed and 'm' not in self.pressed:
-                        claw_cmd = 'abrir_lento'
-
-                    # Sobrescritura por modo perpetuo
-                    if self.perpetual['drive'] is not None:
-                        drive_cmd = self.perpetual['drive']
-                    if self.perpetual['claw'] is not None:
-                        claw_cmd = self.perpetual['claw']
-
-                    current_state = {'drive': drive_cmd, 'claw': claw_cmd}
-
-                force = (token == 'tick') and (self.perpetual['drive'] is not None or self.perpetual['claw'] is not None)
-                if force or current_state != self.last_state:
-                    await execute_command(self.hub, drive_cmd, claw_cmd, self.log)
-                    self.last_state = current_state
+            # Un supervisor por hub en el mismo loop: cada uno reconecta por su cuenta
+            await asyncio.gather(*(session.run() for session in sessions))
         except asyncio.CancelledError:
             pass
         except Exception as e:
             self.log(f"Error en worker: {e}")
         finally:
-            try:
-                if self.hub:
-                    await self.hub.disconnect()
-                    self.log("Hub desconectado.")
-            except Exception as e:
-                self.log(f"Error al desconectar: {e}")
+            with self.lock:
+                sessions = list(self.sessions.values())
+                self.sessions = {}
+            for session in sessions:
+                if session.state != 'desconectado':
+                    # Sesiones que no llegaron a su supervisor (fallo durante la preparación)
+                    try:
+                        await session.hub.disconnect()
+                        session.log("Hub desconectado.")
+                    except Exception as e:
+                        session.log(f"Error al desconectar: {e}")
+                    session.teardown()
             self.running.clear()
+            self._state = 'desconectado'
+            self.target = TARGET_ALL
+            if self.recorder is not None:
+                self.recorder.save(self.log)
+                self.recorder = None
 
     def start(self):
         if self.thread.is_alive():
             return
+        if self.thread.ident is not None:
+            # El hilo de una conexión anterior ya terminó: cada conexión usa hilo y loop nuevos
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self._thread_main, daemon=True)
         self.thread.start()
 
     def stop(self):
         if self.loop.is_running():
-            for task in asyncio.all_tasks(self.loop):
-                task.cancel()
-            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop.call_soon_threadsafe(self._shutdown)
+
+    def _shutdown(self):
+        # Cancelar el runner y parar el loop cuando su finally haya desconectado los hubs
+        tasks = [t for t in asyncio.all_tasks(self.loop) if t is not self._main_task]
+        for task in tasks:
+            task.cancel()
+        if self._main_task is not None and not self._main_task.done():
+            self._main_task.add_done_callback(lambda _t: self.loop.stop())
+            self._main_task.cancel()
+        else:
+            self.loop.stop()
+
+    @property
+    def hold_ms(self) -> int:
+        """Plazo (ms) de los programas perpetuos con ejecución preventiva; 0 = sin perro guardián."""
+        if not self.preemptive or not self.watchdog_timeout:
+            return 0
+        return int(round(self.watchdog_timeout * 1000))
+
+    def request_ticks(self):
+        # Llamar desde el loop: una sesión empieza a necesitar ticks
+        if self._tick_demand is not None:
+            self._tick_demand.set()
 
     async def _ticker(self):
+        # Tick bajo demanda: cada sesión pide su intervalo (tick_interval) y sólo se despierta
+        # a las que lo necesitan; si ninguna lo necesita, el ticker duerme hasta request_ticks.
+        loop = asyncio.get_running_loop()
         try:
             while True:
-                await asyncio.sleep(0.25)
-                if self.queue is not None:
-                    await self.queue.put('tick')
+                self.ticker_wakeups += 1
+                now = loop.time()
+                with self.lock:
+                    sessions = list(self.sessions.values())
+                due = []
+                for session in sessions:
+                    interval = session.tick_interval()
+                    if interval is None:
+                        session.next_tick = None
+                        continue
+                    if session.next_tick is None:
+                        session.next_tick = now + interval
+                    elif session.next_tick <= now:
+                        session.tick_pending = True
+                        session.wakeup.set()
+                        session.next_tick = now + interval
+                    due.append(session.next_tick)
+                self._tick_demand.clear()
+                if not due:
+                    await self._tick_demand.wait()
+                    continue
+                try:
+                    await asyncio.wait_for(self._tick_demand.wait(), max(0.0, min(due) - now))
+                except asyncio.TimeoutError:
+                    pass
         except asyncio.CancelledError:
             pass
 
-    # Interfaz desde el hilo de la GUI
-    def set_perpetual_drive(self, cmd: Optional[str]):
+    # Destinos de la flota
+    def target_names(self) -> list:
         with self.lock:
-            self.perpetual['drive'] = cmd
-        if self.loop.is_running() and self.queue is not None:
-            self.loop.call_soon_threadsafe(self.queue.put_nowait, 'change')
+            hubs = sorted(self.sessions)
+        groups = [g for g, members in sorted(self.groups.items()) if any(m in hubs for m in members)]
+        return [TARGET_ALL] + hubs + groups
+
+    def _targets(self) -> list:
+        # Llamar con self.lock tomado
+        if self.target == TARGET_ALL:
+            return list(self.sessions.values())
+        if self.target in self.sessions:
+            return [self.sessions[self.target]]
+        return [self.sessions[n] for n in self.groups.get(self.target, ()) if n in self.sessions]
+
+    def set_target(self, target: str):
+        with self.lock:
+            previous = self._targets()
+            self.target = target
+            current = self._targets()
+            # Los hubs que dejan de recibir órdenes sueltan las teclas (el perpetuo se conserva)
+            released = [s for s in previous if s not in current and s.release_keys()]
+        self._notify(released)
+
+    def _begin_traces(self, sessions: list, start_ns: int):
+        # Llamar con self.lock tomado: abre la traza de cada hub que cambió (si no tenía una pendiente)
+        for session in sessions:
+            if session.trace is None:
+                session.trace = self.tracer.begin(session.name, start_ns)
+                session.trace.mark('lock')
+
+    def _notify(self, sessions: list):
+        # Despierta a los supervisores; varias llamadas antes de procesarse equivalen a una
+        if sessions and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._wake, sessions)
+
+    @staticmethod
+    def _wake(sessions: list):
+        for session in sessions:
+            session.wakeup.set()
+
+    def set_telemetry_rate(self, rate: float):
+        self.telemetry_rate = max(0.0, float(rate))
+        with self.lock:
+            sessions = list(self.sessions.values())
+        self._notify(sessions)
 
-    def set_perpetual_claw(self, cmd: Optional[str]):
+    def telemetry_sample(self) -> Optional[dict]:
+        """Última muestra del primer hub del destino actual (None si aún no hay)."""
+        with self.lock:
+            targets = self._targets()
+        for session in targets:
+            sample = session.telemetry.latest()
+            if sample is not None:
+                return dict(sample, hub=session.name)
+        return None
+
+    # Interfaz desde el hilo de la GUI y del mando
+    def apply_input(self, keys: Optional[int] = None, perpetual: Optional[dict] = None,
+                    source: str = 'gui', speeds: Optional[tuple] = None) -> bool:
+        """Aplica de forma atómica un fotograma de entrada completo de una fuente.
+
+        keys: máscara (KEY_BIT) de todas las teclas que la fuente mantiene pulsadas (None = no
+        cambian); las de distintas fuentes se combinan con OR. perpetual: sobrescrituras a cambiar, p. ej.
+        {'claw': 'cerrar'} o {'drive': None}. speeds: consigna analógica (velocidad A, velocidad C)
+        ya cuantizada, (0, 0) para soltarla (None = no cambia). Se diferencia contra el estado actual bajo un solo
+        lock y se despierta como mucho una vez; un fotograma sin cambios se descarta.
+        Devuelve True si algún hub del destino cambió de estado.
+        """
+        start_ns = time.perf_counter_ns()
+        if self.recorder is not None:
+            self.recorder.record(source=source, keys=keys, perpetual=perpetual, speeds=speeds)
         with self.lock:
-            self.perpetual['claw'] = cmd
-        if self.loop.is_running() and self.queue is not None:
-            self.loop.call_soon_threadsafe(self.queue.put_nowait, 'change')
+            changed = []
+            for session in self._targets():
+                keys_changed = keys is not None and session.set_input(source, keys)
+                perpetual_changed = bool(perpetual) and session.set_perpetual(perpetual)
+                speeds_changed = speeds is not None and session.set_speeds(speeds)
+                if keys_changed or perpetual_changed or speeds_changed:
+                    changed.append(session)
+            self._begin_traces(changed, start_ns)
+        self._notify(changed)
+        return bool(changed)
+
+    def set_perpetual_drive(self, cmd: Optional[str]):
+        self.apply_input(perpetual={'drive': cmd})
+
+    def set_perpetual_claw(self, cmd: Optional[str]):
+        self.apply_input(perpetual={'claw': cmd})
 
     def clear_perpetual(self):
-        with self.lock:
-            self.perpetual = {'drive': None, 'claw': None}
-        if self.loop.is_running() and self.queue is not None:
-            self.loop.call_soon_threadsafe(self.queue.put_nowait, 'change')
+        self.apply_input(perpetual={'drive': None, 'claw': None})
 
-    def set_key(self, key: str, down: bool):
+    def set_key(self, key: str, down: bool, source: str = 'gui'):
+        bit = KEY_BIT[key]
+        start_ns = time.perf_counter_ns()
+        if self.recorder is not None:
+            self.recorder.record(source=source, key=key, down=down)
         with self.lock:
-            if down:
-                self.pressed.add(key)
-            else:
-                self.pressed.discard(key)
-        if self.loop.is_running() and self.queue is not None:
-            self.loop.call_soon_threadsafe(self.queue.put_nowait, 'change')
+            changed = []
+            for session in self._targets():
+                mask = session.inputs.get(source, 0)
+                mask = mask | bit if down else mask & ~bit
+                if session.set_input(source, mask):
+                    changed.append(session)
+            self._begin_traces(changed, start_ns)
+        self._notify(changed)
 
 # -------------------- Hilo para leer Gamepad (pygame) --------------------
 
+# Con el backend en el loop BLE se vacía la cola de eventos de pygame cada GAMEPAD_POLL_INTERVAL
+# (el mismo ritmo que el sondeo original, no más despertares); sólo un cambio real del estado del
+# mando llega al worker.
+GAMEPAD_POLL_INTERVAL = 0.03
+# Espera máxima de pygame.event.wait en el backend de hilo (ms), para poder atender stop()
+GAMEPAD_WAIT_MS = 200
+
+GAMEPAD_IDLE = {'keys': 0, 'speeds': (0, 0), 'perpetual_drive': None, 'buttons': frozenset()}
+
+def _axis(joystick, index: int, default=None):
+    try:
+        return joystick.get_axis(index)
+    except Exception:
+        return default
+
+def _button(joystick, index: int, default=None):
+    try:
+        return joystick.get_button(index)
+    except Exception:
+        return default
+
+def read_gamepad(joystick, analog: bool = False) -> dict:
+    """Instantánea del mando traducida a la interfaz del worker (mapeo de GamepadThread).
+
+    - keys: máscara KEY_BIT de las teclas equivalentes pulsadas (i/j/k/l, w/a/s/d, x/z, m/n).
+    - speeds: consigna analógica del stick izquierdo con analog=True (si no, (0, 0) y WASD).
+    - perpetual_drive: orden perpetua que pide el stick derecho, o None si está en el centro.
+    - buttons: botones de acción pulsados ('cuadrado', 'circulo', 'triangulo', 'start').
+    """
+    keys = 0
+
+    # D-PAD -> movimiento lento (i/j/k/l)
+    try:
+        hatx, haty = joystick.get_hat(0)
+    except Exception:
+        hatx = haty = 0
+    if haty == 1:
+        keys |= KEY_BIT['i']
+    if haty == -1:
+        keys |= KEY_BIT['k']
+    if hatx == -1:
+        keys |= KEY_BIT['j']
+    if hatx == 1:
+        keys |= KEY_BIT['l']
+
+    # Stick izquierdo -> velocidades continuas (modo analógico) o WASD rápido
+    lx = _axis(joystick, 0, 0.0)
+    ly = _axis(joystick, 1, 0.0)
+    speeds = (0, 0)
+    dead = 0.25
+    if analog:
+        speeds = stick_to_speeds(lx, ly)
+    else:
+        if ly < -dead:
+            keys |= KEY_BIT['w']
+        if ly > dead:
+            keys |= KEY_BIT['s']
+        if lx < -dead:
+            keys |= KEY_BIT['a']
+        if lx > dead:
+            keys |= KEY_BIT['d']
+
+    # Stick derecho -> movimiento perpetuo (no se desactiva al volver al centro)
+    rx = _axis(joystick, 2, 0.0)
+    ry = _axis(joystick, 3, 0.0)
+    perpetual_drive = None
+    if ry < -0.5:
+        perpetual_drive = 'adelante'
+    elif ry > 0.5:
+        perpetual_drive = 'atras'
+    elif rx < -0.5:
+        perpetual_drive = 'izquierda'
+    elif rx > 0.5:
+        perpetual_drive = 'derecha'
+
+    # Gatillos L2/R2 (axis 4 o 2 / axis 5; PS4 da -1..1 o 0..1, se compara por magnitud)
+    lt = _axis(joystick, 4)
+    if lt is None:
+        lt = _axis(joystick, 2, 0.0)
+    rt = _axis(joystick, 5, 0.0)
+    trig_thresh = 0.4
+    if lt > trig_thresh or lt < -trig_thresh:
+        keys |= KEY_BIT['x']
+    if rt > trig_thresh or rt < -trig_thresh:
+        keys |= KEY_BIT['z']
+
+    # L1 cerrar lento (m) / R1 abrir lento (n); con ambos pulsados gana R1
+    if _button(joystick, 5, 0) == 1:
+        keys |= KEY_BIT['n']
+    elif _button(joystick, 4, 0) == 1:
+        keys |= KEY_BIT['m']
+
+    # Botones de acción: Cuadrado 2, Círculo 1, Triángulo 3, START/OPTIONS 9 (u 8)
+    buttons = set()
+    for name, index in (('cuadrado', 2), ('circulo', 1), ('triangulo', 3)):
+        if _button(joystick, index, 0) == 1:
+            buttons.add(name)
+    start = _button(joystick, 9)
+    if start is None:
+        start = _button(joystick, 8, 0)
+    if start == 1:
+        buttons.add('start')
+
+    return {'keys': keys, 'speeds': speeds, 'perpetual_drive': perpetual_drive, 'buttons': frozenset(buttons)}
+
 class GamepadThread:
     """
     Mapeo PS4:
@@ -323,16 +2681,33 @@ class GamepadThread:
         - btn_square -> cerrar continuo (set_perpetual_claw('cerrar'))
         - btn_circle -> abrir continuo (set_perpetual_claw('abrir'))
         - btn_triangle -> detener continuidad (clear_perpetual)
+
+    Dirigido por eventos: sólo se relee el mando cuando pygame entrega JOYAXISMOTION,
+    JOYBUTTONDOWN/UP, JOYHATMOTION o JOYDEVICEADDED/REMOVED, y al worker sólo llegan las
+    diferencias con la instantánea anterior (los botones de acción actúan al pulsarse).
+    backend='loop' lo ejecuta como tarea en el loop del BLEWorker; 'thread', en un hilo propio.
+    Con analog=True el stick izquierdo envía velocidades continuas en lugar de WASD.
     """
-    def __init__(self, worker: BLEWorker, log_queue: Queue):
+    def __init__(self, worker: BLEWorker, log_queue: Queue, backend: str = 'loop', analog: bool = False):
         self.worker = worker
-        self.log = lambda m: log_queue.put(m)
+        self.log = lambda m: log_queue.put(('mando', m))
+        self.backend = backend
+        self.analog = analog
         self.t = None
+        self._future = None
         self._stop = threading.Event()
         self.joystick = None
+        self._last = GAMEPAD_IDLE
+        self._last_analog = analog
+        # Métricas: eventos de pygame recibidos y fotogramas entregados al worker
+        self.events = 0
+        self.published = 0
+
+    def is_running(self) -> bool:
+        return bool((self.t and self.t.is_alive()) or (self._future and not self._future.done()))
 
     def start(self):
-        if not GAMEPAD_AVAILABLE or (self.t and self.t.is_alive()):
+        if not GAMEPAD_AVAILABLE or self.is_running():
             if not GAMEPAD_AVAILABLE:
                 self.log("No hay mando disponible (pygame).")
             return
@@ -348,221 +2723,234 @@ class GamepadThread:
             return
 
         self._stop.clear()
-        self.t = threading.Thread(target=self._run, daemon=True)
-        self.t.start()
+        self._last = GAMEPAD_IDLE
+        self._last_analog = self.analog
+        if self.backend == 'loop' and self.worker.loop.is_running():
+            self._future = asyncio.run_coroutine_threadsafe(self._run_async(), self.worker.loop)
+        else:
+            self.t = threading.Thread(target=self._run, daemon=True)
+            self.t.start()
         self.log("Control de mando activo (pygame).")
 
     def stop(self):
         self._stop.set()
+        if self._future is not None:
+            self._future.cancel()
+
+    def _process(self, events):
+        # Atiende un lote de eventos; devuelve tras publicar, como mucho, una instantánea
+        # Cambiar de modo (analógico / WASD) obliga a releer el stick
+        changed = self.analog != self._last_analog
+        for event in events:
+            if event.type == pygame.JOYDEVICEADDED and self.joystick is None:
+                try:
+                    self.joystick = pygame.joystick.Joystick(event.device_index)
+                    self.joystick.init()
+                    self.log(f"Mando (re)conectado: {self.joystick.get_name()}")
+                    changed = True
+                except Exception:
+                    self.joystick = None
+            elif event.type == pygame.JOYDEVICEREMOVED:
+                if self.joystick is not None and event.instance_id == self.joystick.get_instance_id():
+                    self.joystick = None
+                    self.log("Mando desconectado; esperando reconexión…")
+                    changed = True
+            elif event.type in (pygame.JOYAXISMOTION, pygame.JOYBUTTONDOWN,
+                                pygame.JOYBUTTONUP, pygame.JOYHATMOTION):
+                self.events += 1
+                changed = True
+        if changed:
+            self._last_analog = self.analog
+            self._publish(read_gamepad(self.joystick, self.analog) if self.joystick is not None else GAMEPAD_IDLE)
+
+    def _publish(self, snapshot: dict):
+        # Un único fotograma por lote de eventos: el worker nunca ve medio mando aplicado
+        last = self._last
+        self._last = snapshot
+        perpetual = {}
+
+        # Perpetuo de drive: al inclinar el stick (o cambiar de dirección), sin desactivar al soltar
+        perp_cmd = snapshot['perpetual_drive']
+        if perp_cmd is not None and perp_cmd != last['perpetual_drive']:
+            perpetual['drive'] = perp_cmd
+            self.log(f"Perpetuo drive activado: {perp_cmd}")
+
+        pressed = snapshot['buttons'] - last['buttons']
+        if 'cuadrado' in pressed:
+            perpetual['claw'] = 'cerrar'
+            self.log("Perpetuo garra: cerrar")
+        if 'circulo' in pressed:
+            perpetual['claw'] = 'abrir'
+            self.log("Perpetuo garra: abrir")
+        if 'triangulo' in pressed:
+            # detener únicamente la parte de garra perpetua
+            perpetual['claw'] = None
+            self.log("Perpetuo garra detenido (triangle)")
+        if 'start' in pressed:
+            # stop inmediato sin limpiar las teclas pulsadas
+            perpetual['claw'] = 'stop'
+            self.log("Stop garra inmediato (START)")
+
+        if snapshot['keys'] != last['keys'] or snapshot['speeds'] != last['speeds'] or perpetual:
+            self.worker.apply_input(snapshot['keys'], perpetual, source='gamepad', speeds=snapshot['speeds'])
+            self.published += 1
+
+    def _release(self):
+        # Al dejar de leer el mando no debe quedar ninguna tecla suya pulsada en el worker
+        try:
+            self._publish(GAMEPAD_IDLE)
+        except Exception:
+            pass
+
+    async def _run_async(self):
+        try:
+            self._publish(read_gamepad(self.joystick, self.analog))
+            while not self._stop.is_set():
+                self._process(pygame.event.get())
+                await asyncio.sleep(GAMEPAD_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.log(f"Mando desconectado o no disponible: {e}")
+        finally:
+            self._release()
+            self.log("Lectura de mando finalizada.")
 
     def _run(self):
         try:
-            # Loop de lectura del mando
+            self._publish(read_gamepad(self.joystick, self.analog))
             while not self._stop.is_set():
-                # Procesar eventos internos de pygame
+                # Bloquea hasta el siguiente evento (o GAMEPAD_WAIT_MS): sin espera activa
                 try:
-                    pygame.event.pump()
+                    event = pygame.event.wait(GAMEPAD_WAIT_MS)
                 except Exception:
-                    # Si hay error con pygame, terminamos el hilo
-                    self.log("Error en pygame.event.pump(), deteniendo lectura de mando.")
+                    self.log("Error en pygame.event.wait(), deteniendo lectura de mando.")
                     break
-
-                # Re-detectar joystick si es necesario
-                if self.joystick is None or not getattr(self.joystick, 'get_init', lambda: True)():
-                    try:
-                        if pygame.joystick.get_count() > 0:
-                            self.joystick = pygame.joystick.Joystick(0)
-                            self.joystick.init()
-                            self.log(f"Mando (re)conectado: {self.joystick.get_name()}")
-                        else:
-                            pygame.time.wait(200)
-                            continue
-                    except Exception:
-                        pygame.time.wait(200)
-                        continue
-
-                # --- LECTURA DE HAT (D-PAD) para movimiento lento (i/j/k/l) ---
-                try:
-                    hatx, haty = self.joystick.get_hat(0)
-                except Exception:
-                    hatx = haty = 0
-
-                # Mapear hat -> i/j/k/l (lento)
-                self.worker.set_key('i', haty == 1)    # up -> adelante lento
-                self.worker.set_key('k', haty == -1)   # down -> atrás lento
-                self.worker.set_key('j', hatx == -1)   # left -> izquierda lento
-                self.worker.set_key('l', hatx == 1)    # right -> derecha lento
-
-                # --- LEFT STICK para WASD rápido (por compatibilidad con teclado/GUI) ---
-                try:
-                    lx = self.joystick.get_axis(0)
-                    ly = self.joystick.get_axis(1)
-                except Exception:
-                    lx = ly = 0.0
-
-                dead = 0.25
-                self.worker.set_key('w', ly < -dead)
-                self.worker.set_key('s', ly > dead)
-                self.worker.set_key('a', lx < -dead)
-                self.worker.set_key('d', lx > dead)
-
-                # --- RIGHT STICK para MOVIMIENTO PERPETUO (override) ---
-                # según tu confirmación: no se desactiva automáticamente al volver al centro (respuesta 1 = No)
-                # Así que sólo se cambia el modo perpetuo cuando el stick supera deadzone.
-                try:
-                    rx = self.joystick.get_axis(2)
-                    ry = self.joystick.get_axis(3)
-                except Exception:
-                    rx = ry = 0.0
-
-                # Determinar dirección perpetua si el stick derecho está inclinado
-                perp_cmd = None
-                if ry < -0.5:
-                    perp_cmd = 'adelante'
-                elif ry > 0.5:
-                    perp_cmd = 'atras'
-                elif rx < -0.5:
-                    perp_cmd = 'izquierda'
-                elif rx > 0.5:
-                    perp_cmd = 'derecha'
-
-                # Si se detecta inclinación, activamos modo perpetuo correspondiente.
-                # Si no se detecta inclinación, NO lo desactivamos (respuesta 1 = No).
-                if perp_cmd is not None:
-                    # Al activar perpetuo, queremos que esto sobrescriba otras entradas (respuesta 3 = Si)
-                    self.worker.set_perpetual_drive(perp_cmd)
-                    # opcional: log
-                    self.log(f"Perpetuo drive activado: {perp_cmd}")
-
-                # --- GATILLOS (L2/R2 asíncronos: axis) y L1/R1 (botones) ---
-                # Intentamos leer triggers por axis (común en muchos mapeos).
-                # L2 -> cerrar garra, R2 -> abrir garra
-                try:
-                    # Muchos sticks reportan triggers en axis 4/5 o 2/5; intentamos varios
-                    lt = None
-                    rt = None
-                    # comprobar algunos índices plausibles (4,5 y también 2,5)
-                    for idx in (4, 2):
-                        try:
-                            val = self.joystick.get_axis(idx)
-                        except Exception:
-                            val = None
-                        if val is not None:
-                            # guardamos primera lectura válida
-                            if lt is None:
-                                lt = val
-                    for idx in (5, 5):
-                        try:
-                            val = self.joystick.get_axis(idx)
-                        except Exception:
-                            val = None
-                        if val is not None:
-                            if rt is None:
-                                rt = val
-                    # normalizar None -> 0
-                    if lt is None: lt = 0.0
-                    if rt is None: rt = 0.0
-                except Exception:
-                    lt = rt = 0.0
-
-                # Umbral para triggers (analógico)
-                # PS4 a veces da -1..1, a veces 0..1; comprobamos por magnitud
-                trig_thresh = 0.4
-                # L2 -> cerrar (map to 'x' pressed)
-                if lt and (lt > trig_thresh or lt < -trig_thresh):
-                    # activamos cerrar garra (equivalente a presionar botón 'x')
-                    self.worker.set_key('x', True)
-                else:
-                    # no forzamos liberación si usuario mantiene otro input; respetamos pressed state
-                    # pero para mantener comportamiento estable, solo desactivamos si axis no activo
-                    self.worker.set_key('x', False)
-
-                # R2 -> abrir (map to 'z' pressed)
-                if rt and (rt > trig_thresh or rt < -trig_thresh):
-                    self.worker.set_key('z', True)
-                else:
-                    self.worker.set_key('z', False)
-
-                # L1 / R1 normalmente son botones (índices comunes 4 y 5, pero puede variar).
-                try:
-                    btn_l1 = self.joystick.get_button(4)
-                except Exception:
-                    btn_l1 = 0
-                try:
-                    btn_r1 = self.joystick.get_button(5)
-                except Exception:
-                    btn_r1 = 0
-
-                # L1 cerrar lento -> m (cerrar_lento)
-                if btn_l1 == 1:
-                    self.worker.set_key('m', True)
-                    # ensure other slow open key off
-                    self.worker.set_key('n', False)
-                else:
-                    self.worker.set_key('m', False)
-
-                # R1 abrir lento -> n
-                if btn_r1 == 1:
-                    self.worker.set_key('n', True)
-                    self.worker.set_key('m', False)
-                else:
-                    self.worker.set_key('n', False)
-
-                # --- BOTONES FACE y START/OPTIONS ---
-                # mapeos comunes de botones (puede variar por sistema; se intenta usar el mapeo típico)
-                try:
-                    btn_0 = self.joystick.get_button(0)  # X / Cross (a menudo)
-                    btn_1 = self.joystick.get_button(1)  # Circle (a menudo)
-                    btn_2 = self.joystick.get_button(2)  # Square (a menudo)
-                    btn_3 = self.joystick.get_button(3)  # Triangle (a menudo)
-                except Exception:
-                    btn_0 = btn_1 = btn_2 = btn_3 = 0
-
-                # Interpretación solicitada:
-                # Square (btn_2) => cerrar continuo
-                # Circle (btn_1) => abrir continuo
-                # Triangle (btn_3) => detener continuidad (clear_perpetual for claw)
-                # Start/Options -> stop garra inmediato (we try button index 9 or 8)
-                try:
-                    btn_start = self.joystick.get_button(9)
-                except Exception:
-                    try:
-                        btn_start = self.joystick.get_button(8)
-                    except Exception:
-                        btn_start = 0
-
-                # Cuadrado -> cerrar continuo
-                if btn_2 == 1:
-                    self.worker.set_perpetual_claw('cerrar')
-                    self.log("Perpetuo garra: cerrar")
-                # Círculo -> abrir continuo
-                if btn_1 == 1:
-                    self.worker.set_perpetual_claw('abrir')
-                    self.log("Perpetuo garra: abrir")
-                # Triángulo -> detener continuidad (garra)
-                if btn_3 == 1:
-                    # detener únicamente la parte de garra perpetua
-                    # implementamos conservadoramente: si hay un perpetual de garra, lo limpiamos.
-                    with self.worker.lock:
-                        self.worker.perpetual['claw'] = None
-                    if self.worker.loop.is_running() and self.worker.queue is not None:
-                        self.worker.loop.call_soon_threadsafe(self.worker.queue.put_nowait, 'change')
-                    self.log("Perpetuo garra detenido (triangle)")
-
-                # START/OPTIONS -> stop garra inmediato (no limpiar pressed per tu respuesta)
-                if btn_start == 1:
-                    # set perpetual claw to 'stop' so runner will send stop command (without clearing pressed)
-                    self.worker.set_perpetual_claw('stop')
-                    self.log("Stop garra inmediato (START)")
-
-                # Small wait to avoid busy loop
-                pygame.time.wait(30)
-
+                if event.type == pygame.NOEVENT:
+                    self._process(())
+                    continue
+                self._process([event] + pygame.event.get())
         except Exception as e:
             self.log(f"Mando desconectado o no disponible: {e}")
         finally:
+            self._release()
             self.log("Lectura de mando finalizada.")
 
+# -------------------- Registro: limitación, deduplicación y archivo rotativo --------------------
+
+LOG_PATH = os.path.join(os.path.expanduser('~'), '.spike_claw.log')
+LOG_FILE_MAX_BYTES = 1024 * 1024
+LOG_FILE_BACKUPS = 3
+# Líneas que conserva el panel "Registro" (las más antiguas se descartan)
+LOG_MAX_LINES = 500
+# Cubo de tokens por fuente: mensajes/s sostenidos y ráfaga máxima que llegan al panel
+LOG_RATE = 10.0
+LOG_BURST = 30
+# Tiempo tras el que se informa de las repeticiones acumuladas aunque no llegue otro mensaje
+LOG_REPEAT_FLUSH = 2.0
+
+class _LogSource:
+    def __init__(self, name: str, now: float):
+        self.name = name
+        self.tokens = float(LOG_BURST)
+        self.stamp = now
+        self.dropped = 0
+        self.last = None
+        self.repeats = 0
+        self.repeat_since = now
+
+class LogPipeline:
+    """Entre log_queue y el panel: limita y deduplica por fuente y agrupa la inserción.
+
+    Los productores ponen (fuente, mensaje) o un str (fuente 'gui') en la cola. Todo mensaje
+    se escribe íntegro en un archivo rotativo desde un hilo propio (QueueListener); al panel
+    sólo llegan los que pasan el límite, con las repeticiones resumidas como "repetido N veces".
+    """
+    def __init__(self, log_queue: Queue, path: Optional[str] = LOG_PATH):
+        self.log_queue = log_queue
+        self.path = path
+        self._sources = {}
+        self._listener = None
+        self._logger = logging.getLogger('spike_claw')
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if path:
+            try:
+                handler = logging.handlers.RotatingFileHandler(
+                    path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8'
+                )
+                handler.setFormatter(logging.Formatter('%(asctime)s [%(source)s] %(message)s'))
+                file_queue = Queue()
+                self._logger.addHandler(logging.handlers.QueueHandler(file_queue))
+                self._listener = logging.handlers.QueueListener(file_queue, handler)
+                self._listener.start()
+            except OSError:
+                self._listener = None
+                self.path = None
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+
+    def drain(self) -> list:
+        """Vacía la cola y devuelve las líneas a mostrar en este ciclo."""
+        now = time.monotonic()
+        lines = []
+        try:
+            while True:
+                item = self.log_queue.get_nowait()
+                source, msg = item if isinstance(item, tuple) else ('gui', item)
+                self._logger.info(msg, extra={'source': source})
+                self._accept(source, msg, now, lines)
+        except Empty:
+            pass
+        for state in self._sources.values():
+            self._flush(state, now, lines)
+        return lines
+
+    def _accept(self, source: str, msg: str, now: float, lines: list):
+        state = self._sources.get(source)
+        if state is None:
+            state = self._sources[source] = _LogSource(source, now)
+        if msg == state.last:
+            # Repetición consecutiva: se cuenta y se resume más tarde
+            if state.repeats == 0:
+                state.repeat_since = now
+            state.repeats += 1
+            return
+        self._flush_repeats(state, lines)
+        state.last = msg
+
+        state.tokens = min(LOG_BURST, state.tokens + (now - state.stamp) * LOG_RATE)
+        state.stamp = now
+        if state.tokens < 1:
+            state.dropped += 1
+            return
+        state.tokens -= 1
+        self._flush_dropped(state, lines)
+        lines.append(msg)
+
+    def _flush(self, state: _LogSource, now: float, lines: list):
+        if state.repeats and now - state.repeat_since >= LOG_REPEAT_FLUSH:
+            self._flush_repeats(state, lines)
+        if state.dropped and min(LOG_BURST, state.tokens + (now - state.stamp) * LOG_RATE) >= 1:
+            self._flush_dropped(state, lines)
+
+    @staticmethod
+    def _flush_repeats(state: _LogSource, lines: list):
+        if state.repeats:
+            lines.append(f"  (repetido {state.repeats} {'vez' if state.repeats == 1 else 'veces'})")
+            state.repeats = 0
+
+    def _flush_dropped(self, state: _LogSource, lines: list):
+        if state.dropped:
+            where = f"; ver {self.path}" if self.path else ""
+            lines.append(f"  ({state.dropped} mensajes de '{state.name}' omitidos en el panel{where})")
+            state.dropped = 0
+
 # -------------------- Interfaz gráfica (Tkinter) --------------------
 
 class LegoGUI:
@@ -570,9 +2958,10 @@ class LegoGUI:
         self.root = root
         self.root.title("Control de Garra LEGO – Pybricks")
         self.root.geometry("680x520")
-        self.root.minsize(840, 480)
+        self.root.minsize(1000, 480)
 
         self.log_queue = Queue()
+        self.log_pipeline = LogPipeline(self.log_queue)
         self.worker = BLEWorker(self.log_queue)
         self.gamepad = GamepadThread(self.worker, self.log_queue)
 
@@ -612,12 +3001,43 @@ class LegoGUI:
         if GAMEPAD_AVAILABLE:
             self.btn_gamepad = ttk.Button(top, text="Activar mando", command=self.on_toggle_gamepad, state='disabled')
             self.btn_gamepad.pack(side='left', padx=(20, 0))
+            # Conducción analógica: el stick izquierdo fija velocidades continuas (modo streaming)
+            self.var_analog = tk.BooleanVar(value=False)
+            ttk.Checkbutton(top, text="Analógico", variable=self.var_analog,
+                            command=lambda: setattr(self.gamepad, 'analog', self.var_analog.get())).pack(side='left', padx=(8, 0))
         else:
             self.btn_gamepad = None
 
+        self.var_streaming = tk.BooleanVar(value=True)
+        self.chk_streaming = ttk.Checkbutton(top, text="Modo streaming", variable=self.var_streaming)
+        self.chk_streaming.pack(side='left', padx=(20, 0))
+        # Sin Bluetooth: hubs simulados en el propio proceso (pruebas y perfilado)
+        self.var_offline = tk.BooleanVar(value=False)
+        self.chk_offline = ttk.Checkbutton(top, text="Simulador", variable=self.var_offline)
+        self.chk_offline.pack(side='left', padx=(8, 0))
+
+        # Modo flota: número de hubs a conectar y destino de las órdenes
+        ttk.Label(top, text="Hubs:").pack(side='left', padx=(20, 0))
+        self.var_fleet = tk.IntVar(value=1)
+        self.spn_fleet = ttk.Spinbox(top, from_=1, to=FLEET_MAX_HUBS, width=3, textvariable=self.var_fleet, state='readonly')
+        self.spn_fleet.pack(side='left', padx=(4, 0))
+        self.var_target = tk.StringVar(value=TARGET_ALL)
+        self.cmb_target = ttk.Combobox(top, textvariable=self.var_target, width=14, state='disabled')
+        self.cmb_target.pack(side='left', padx=(8, 0))
+        self.cmb_target.bind('<<ComboboxSelected>>', lambda _e: self.worker.set_target(self.var_target.get()))
+
         self.status = ttk.Label(top, text="Estado: sin conexión")
         self.status.pack(side='right')
 
+        # Telemetría en vivo (requiere modo streaming)
+        tele = ttk.Frame(self.root, padding=(10, 0))
+        tele.pack(fill='x')
+        self.var_telemetry = tk.BooleanVar(value=False)
+        ttk.Checkbutton(tele, text="Telemetría", variable=self.var_telemetry,
+                        command=self.on_toggle_telemetry).pack(side='left')
+        self.telemetry_label = ttk.Label(tele, text="—", font=('TkFixedFont', 9))
+        self.telemetry_label.pack(side='left', padx=(10, 0))
+
         body = ttk.Frame(self.root, padding=10)
         body.pack(fill='both', expand=True)
 
@@ -681,6 +3101,10 @@ class LegoGUI:
         self.log_text = tk.Text(logf, height=8, wrap='word')
         self.log_text.pack(fill='both', expand=True)
         self.log_text.configure(state='disabled')
+        tracef = ttk.Frame(logf)
+        tracef.pack(fill='x', pady=(4, 0))
+        ttk.Button(tracef, text="Latencias", command=self.on_latency_report).pack(side='left')
+        ttk.Button(tracef, text="Exportar traza…", command=self.on_export_trace).pack(side='left', padx=(6, 0))
 
     def _mk_hold_button(self, parent, text, key_on, row, col, command=None):
         btn = ttk.Button(parent, text=text)
@@ -713,10 +3137,19 @@ class LegoGUI:
             for msg in _MPY_SETUP_LOG:
                 self._log(f"[Setup] {msg}")
         
+        self.worker.streaming = self.var_streaming.get()
+        self.worker.fleet_size = self.var_fleet.get()
+        self.worker.offline = self.var_offline.get()
+        self.chk_streaming.configure(state='disabled')
+        self.chk_offline.configure(state='disabled')
+        self.spn_fleet.configure(state='disabled')
         self.worker.start()
         def check_ready():
             if self.worker.running.is_set():
                 self.status.configure(text="Estado: conectado")
+                if self.worker.fleet_size > 1:
+                    self.cmb_target.configure(values=self.worker.target_names(), state='readonly')
+                    self.var_target.set(TARGET_ALL)
                 self.btn_connect.configure(state='disabled')
                 self.btn_disconnect.configure(state='normal')
                 if self.btn_gamepad is not None:
@@ -732,7 +3165,13 @@ class LegoGUI:
         finally:
             self.btn_connect.configure(state='normal')
             self.btn_disconnect.configure(state='disabled')
+            self.chk_streaming.configure(state='normal')
+            self.chk_offline.configure(state='normal')
+            self.spn_fleet.configure(state='readonly')
+            self.cmb_target.configure(state='disabled')
+            self.var_target.set(TARGET_ALL)
             if self.btn_gamepad is not None:
+                self.gamepad.stop()
                 self.btn_gamepad.configure(state='disabled', text='Activar mando')
             self.status.configure(text="Estado: sin conexión")
             self._log("Desconectado.")
@@ -769,21 +3208,79 @@ class LegoGUI:
         self.log_queue.put(msg)
 
     def _poll_logs(self):
-        try:
-            while True:
-                msg = self.log_queue.get_nowait()
-                self.log_text.configure(state='normal')
-                self.log_text.insert('end', msg + "\n")
-                self.log_text.see('end')
-                self.log_text.configure(state='disabled')
-        except Empty:
-            pass
+        # Una sola inserción por ciclo y panel acotado a LOG_MAX_LINES (búfer circular)
+        lines = self.log_pipeline.drain()
+        if lines:
+            self.log_text.configure(state='normal')
+            self.log_text.insert('end', "\n".join(lines) + "\n")
+            excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - LOG_MAX_LINES
+            if excess > 0:
+                self.log_text.delete('1.0', f'{excess + 1}.0')
+            self.log_text.see('end')
+            self.log_text.configure(state='disabled')
+        self._refresh_status()
         self.root.after(150, self._poll_logs)
 
+    def _refresh_status(self):
+        # Refleja en la barra de estado las reconexiones automáticas del worker
+        if not self.worker.running.is_set():
+            return
+        text = "Estado: reconectando…" if self.worker.state == 'reconectando' else "Estado: conectado"
+        if self.status.cget('text') != text:
+            self.status.configure(text=text)
+        self._refresh_telemetry()
+
+    def on_latency_report(self):
+        if not self.worker.tracer.durations:
+            self._log("Sin trazas todavía: envía alguna orden primero.")
+            return
+        for line in self.worker.tracer.report().splitlines():
+            self._log(line)
+        metrics = self.worker.metrics
+        self._log(f"Ticks: {metrics['ticks']} (sin envío: {metrics['idle_ticks']}), "
+                  f"despertares del ticker: {metrics['ticker_wakeups']}, "
+                  f"órdenes de garra descartadas: {metrics['claw_dropped']}")
+
+    def on_export_trace(self):
+        path = filedialog.asksaveasfilename(
+            title="Exportar traza", defaultextension='.json',
+            filetypes=[("Chrome trace (JSON)", '*.json')], initialfile='spike_trace.json')
+        if not path:
+            return
+        try:
+            self.worker.tracer.export_chrome_trace(path)
+            self._log(f"Traza exportada a {path} (ábrela en chrome://tracing o Perfetto).")
+        except OSError as e:
+            self._log(f"No se pudo exportar la traza: {e}")
+
+    def on_toggle_telemetry(self):
+        rate = load_settings().get('telemetry_rate', TELEMETRY_DEFAULT_RATE) if self.var_telemetry.get() else 0
+        self.worker.set_telemetry_rate(rate)
+        if not rate:
+            self.telemetry_label.configure(text="—")
+
+    def _refresh_telemetry(self):
+        if not self.var_telemetry.get():
+            return
+        sample = self.worker.telemetry_sample()
+        if sample is None:
+            return
+        motors = "  ".join(
+            f"{port}: {sample[f'{key}_angle']:>6}° {sample[f'{key}_speed']:>5}°/s c{sample[f'{key}_load']:>4}"
+            for port, key in (('A', 'a'), ('C', 'c'), ('E', 'e'))
+        )
+        text = (f"[{sample['hub']}] {motors}  Bat: {sample['battery_mv'] / 1000:.2f} V  "
+                f"Incl: {sample['pitch']:+}/{sample['roll']:+}°  Rumbo: {sample['heading']}°")
+        if self.telemetry_label.cget('text') != text:
+            self.telemetry_label.configure(text=text)
+
 def main():
     root = tk.Tk()
     app = LegoGUI(root)
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        app.log_pipeline.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,550 @@
+# benchmarks.py
+# Pruebas de rendimiento del canal de control, sin hub ni Bluetooth real.
+# Uso (desde la raíz del repositorio, con el entorno de SistemaControlSpike):
+#   python src/benchmarks.py download [--sizes 2048 8192 32768] [--interval 15]
+#   python src/benchmarks.py fleet [--max-hubs 7] [--interval 15]
+#   python src/benchmarks.py input [--frames 200000]
+#   python src/benchmarks.py telemetry [--samples 20000] [--mtu 20]
+#   python src/benchmarks.py pipeline [--trace entrada.jsonl] [--json resultados.json] [--compare anterior.json]
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from queue import Queue
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pybricksdev.ble.pybricks import HubCapabilityFlag  # type: ignore
+from pybricksdev.connections.pybricks import PybricksHub  # type: ignore
+
+import mpy_cross_v5  # type: ignore
+import mpy_cross_v6  # type: ignore
+
+import SistemaControlSpike
+from SistemaControlSpike import (
+    COMMAND_TABLE,
+    FLEET_MAX_HUBS,
+    INPUT_KEYS,
+    SIMULATOR_DEFAULTS,
+    TELEMETRY_STRUCT,
+    BLEWorker,
+    SpikeHubMixin,
+    TelemetryDecoder,
+    encode_stream_command,
+    keys_mask,
+)
+
+# -------------------- Modelo de enlace BLE --------------------
+
+class LinkModelHub(SpikeHubMixin, PybricksHub):
+    """Hub falso cuyo write_gatt_char imita los tiempos de un enlace BLE.
+
+    - Cada intervalo de conexión admite como mucho packets_per_interval paquetes.
+    - Escritura con respuesta: sólo una petición ATT pendiente a la vez y la respuesta
+      llega en el intervalo siguiente.
+    - Escritura sin respuesta: ocupa un hueco del siguiente intervalo con capacidad.
+    - Varios hubs pueden compartir radio (slots y establish_lock): la capacidad por intervalo
+      y el establecimiento de enlaces (uno a la vez en el controlador) son del adaptador.
+    """
+    def __init__(self, interval: float, packets_per_interval: int, without_response: bool,
+                 max_write_size: int = 158, radio: dict = None,
+                 establish_time: float = 0.0, discovery_time: float = 0.0):
+        super().__init__()
+        self.interval = interval
+        self.packets_per_interval = packets_per_interval
+        self.without_response = without_response
+        self.max_write_size = max_write_size
+        self.establish_time = establish_time
+        self.discovery_time = discovery_time
+        self.packets = 0
+        self._radio = radio if radio is not None else {}
+        self._slots = self._radio.setdefault('slots', {})
+        self._att_lock = None
+
+    async def _client_connect(self) -> bool:
+        lock = self._radio.setdefault('establish_lock', asyncio.Lock())
+        async with lock:
+            await asyncio.sleep(self.establish_time)
+        # Descubrimiento de servicios GATT y lectura de capacidades: por enlace, en paralelo
+        await asyncio.sleep(self.discovery_time)
+        self._max_write_size = self.max_write_size
+        self._capability_flags = HubCapabilityFlag.USER_PROG_MULTI_FILE_MPY6
+        self._max_user_program_size = 256 * 1024
+        self._att_lock = asyncio.Lock()
+        return True
+
+    async def _client_disconnect(self) -> bool:
+        self._handle_disconnect()
+        return True
+
+    async def read_gatt_char(self, uuid: str) -> bytearray:
+        return bytearray()
+
+    async def start_notify(self, uuid: str, callback) -> None:
+        pass
+
+    def _command_write_without_response(self) -> bool:
+        return self.without_response
+
+    async def _next_slot(self):
+        now = asyncio.get_running_loop().time()
+        k = math.ceil(now / self.interval)
+        while self._slots.get(k, 0) >= self.packets_per_interval:
+            k += 1
+        self._slots[k] = self._slots.get(k, 0) + 1
+        await asyncio.sleep(k * self.interval - now)
+
+    async def write_gatt_char(self, uuid: str, data, response: bool) -> None:
+        self.packets += 1
+        if response:
+            async with self._att_lock:
+                await self._next_slot()
+                await asyncio.sleep(self.interval)
+        else:
+            await self._next_slot()
+
+# -------------------- Descarga de programas --------------------
+
+async def _time_download(size: int, change: Optional[int], interval: float) -> tuple:
+    # change: bytes modificados respecto al programa anterior (None = programa nuevo en la conexión)
+    hub = LinkModelHub(interval, packets_per_interval=4, without_response=False)
+    await hub.connect()
+    program = os.urandom(size)
+    if change is not None:
+        await hub.download_user_program(program)
+        program = program[:size // 2] + os.urandom(change) + program[size // 2 + change:]
+    hub.packets = 0
+    start = time.perf_counter()
+    await hub.download_user_program(program)
+    elapsed = time.perf_counter() - start
+    await hub.disconnect()
+    return elapsed, hub.packets
+
+def bench_download(args):
+    modes = [
+        ("completa", None),
+        ("delta (16 bytes cambiados)", 16),
+        ("idéntico", 0),
+    ]
+    print(f"Intervalo de conexión: {args.interval:.1f} ms, 4 paquetes/intervalo, MTU 158")
+    print(f"{'tamaño':>8}  {'modo':<26} {'tiempo':>9} {'paquetes':>9} {'mejora':>7}")
+    for size in args.sizes:
+        baseline = None
+        for name, change in modes:
+            elapsed, packets = asyncio.run(_time_download(size, change, args.interval / 1000))
+            baseline = baseline or elapsed
+            # Sin paquetes (programa idéntico) la mejora no tiene sentido
+            ratio = f"{baseline / elapsed:>6.1f}x" if packets else "     -"
+            print(f"{size:>8}  {name:<26} {elapsed * 1000:>7.0f}ms {packets:>9} {ratio}")
+
+# -------------------- Flota de hubs --------------------
+
+def _fleet(count: int, args) -> list:
+    radio = {}
+    return [
+        LinkModelHub(args.interval / 1000, packets_per_interval=4, without_response=True, radio=radio,
+                     establish_time=args.establish / 1000, discovery_time=args.discovery / 1000)
+        for _ in range(count)
+    ]
+
+async def _time_fleet(count: int, args) -> tuple:
+    # Conexión secuencial (un proceso por robot) frente a connect() concurrente en un loop
+    hubs = _fleet(count, args)
+    start = time.perf_counter()
+    for hub in hubs:
+        await hub.connect()
+    sequential = time.perf_counter() - start
+    await asyncio.gather(*(hub.disconnect() for hub in hubs))
+
+    hubs = _fleet(count, args)
+    start = time.perf_counter()
+    await asyncio.gather(*(hub.connect() for hub in hubs))
+    concurrent = time.perf_counter() - start
+
+    # Reparto de una orden a toda la flota (destino 'todos'): hasta que el último hub la recibe
+    latencies = []
+    for i in range(args.commands):
+        packet = encode_stream_command('adelante' if i % 2 else 'stop', 'stop')
+        start = time.perf_counter()
+        for hub in hubs:
+            hub.stdin_stream().write(packet)
+        await asyncio.gather(*(hub.stdin_stream().flush() for hub in hubs))
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(args.interval / 1000)
+    await asyncio.gather(*(hub.disconnect() for hub in hubs))
+    latencies.sort()
+    return sequential, concurrent, latencies[len(latencies) // 2], latencies[-1]
+
+def bench_fleet(args):
+    print(f"Intervalo de conexión: {args.interval:.1f} ms, radio compartida (4 paquetes/intervalo), "
+          f"establecimiento {args.establish:.0f} ms + descubrimiento {args.discovery:.0f} ms por hub")
+    print(f"{'hubs':>4}  {'conexión sec.':>13} {'concurrente':>12} {'mejora':>7} "
+          f"{'orden p50':>10} {'orden máx':>10}")
+    for count in range(1, args.max_hubs + 1):
+        sequential, concurrent, p50, worst = asyncio.run(_time_fleet(count, args))
+        print(f"{count:>4}  {sequential * 1000:>11.0f}ms {concurrent * 1000:>10.0f}ms "
+              f"{sequential / concurrent:>6.1f}x {p50 * 1000:>8.1f}ms {worst * 1000:>8.1f}ms")
+
+# -------------------- Resolución de entrada por fotograma --------------------
+
+def _legacy_resolve(pressed: set) -> tuple:
+    # Cadena de pruebas de pertenencia anterior a las tablas (compute_drive_command + garra)
+    w, s, a, d = 'w' in pressed, 's' in pressed, 'a' in pressed, 'd' in pressed
+    i, j, k, l = 'i' in pressed, 'j' in pressed, 'k' in pressed, 'l' in pressed
+    if i:
+        drive_cmd = 'adelante_lento'
+    elif k:
+        drive_cmd = 'atras_lento'
+    elif j:
+        drive_cmd = 'izquierda_lento'
+    elif l:
+        drive_cmd = 'derecha_lento'
+    elif w and not s:
+        drive_cmd = 'adelante'
+    elif s and not w:
+        drive_cmd = 'atras'
+    elif a and not d:
+        drive_cmd = 'izquierda'
+    elif d and not a:
+        drive_cmd = 'derecha'
+    else:
+        drive_cmd = 'stop'
+    claw_cmd = 'stop'
+    if 'x' in pressed and 'z' not in pressed:
+        claw_cmd = 'cerrar'
+    elif 'z' in pressed and 'x' not in pressed:
+        claw_cmd = 'abrir'
+    elif 'm' in pressed and 'n' not in pressed:
+        claw_cmd = 'cerrar_lento'
+    elif 'n' in pressed and 'm' not in pressed:
+        claw_cmd = 'abrir_lento'
+    return drive_cmd, claw_cmd
+
+def bench_input(args):
+    # Las tablas deben reproducir exactamente la lógica anterior en las 4096 combinaciones
+    sets = [{key for bit, key in enumerate(INPUT_KEYS) if mask >> bit & 1} for mask in range(len(COMMAND_TABLE))]
+    mismatches = sum(COMMAND_TABLE[mask] != _legacy_resolve(keys) for mask, keys in enumerate(sets))
+    print(f"Combinaciones verificadas: {len(sets)}, discrepancias: {mismatches}")
+
+    rng = random.Random(1)
+    masks = [rng.randrange(len(COMMAND_TABLE)) for _ in range(args.frames)]
+    frames = [sets[mask] for mask in masks]
+    table = COMMAND_TABLE
+
+    start = time.perf_counter()
+    for keys in frames:
+        _legacy_resolve(keys)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for mask in masks:
+        table[mask]
+    lookup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for keys in frames:
+        table[keys_mask(keys)]
+    from_set = time.perf_counter() - start
+
+    print(f"{'método':<34} {'ns/fotograma':>13}")
+    for name, elapsed in (("cadena de if (conjunto de teclas)", legacy),
+                          ("tabla (máscara de bits)", lookup),
+                          ("tabla + keys_mask(conjunto)", from_set)):
+        print(f"{name:<34} {elapsed / args.frames * 1e9:>13.0f}")
+
+# -------------------- Decodificación de telemetría --------------------
+
+def bench_telemetry(args):
+    rng = random.Random(2)
+    frames = []
+    for i in range(args.samples):
+        values = [rng.randint(-30000, 30000) for _ in range(9)]
+        frame = TELEMETRY_STRUCT.pack(0xA5, i & 0xFF, (i * 50) & 0xFFFF,
+                                      rng.randint(-10**6, 10**6), *values[0:2],
+                                      rng.randint(-10**6, 10**6), *values[2:4],
+                                      rng.randint(-10**6, 10**6), *values[4:6],
+                                      rng.randint(6000, 8400), *values[6:9])
+        frames.append(frame + bytes([sum(frame) & 0xFF]))
+    stream = b''.join(frames)
+    # Los eventos WRITE_STDOUT llegan troceados según el MTU, sin respetar los límites de trama
+    payload = args.mtu - 1
+    chunks = [stream[k:k + payload] for k in range(0, len(stream), payload)]
+
+    decoder = TelemetryDecoder()
+    start = time.perf_counter()
+    for data in chunks:
+        decoder.feed(data)
+    elapsed = time.perf_counter() - start
+
+    assert decoder.frames == args.samples and decoder.errors == 0
+    per_sample = elapsed / args.samples
+    print(f"Tramas: {args.samples} de {len(frames[0])} bytes, en {len(chunks)} eventos de {payload} bytes")
+    print(f"Decodificación: {per_sample * 1e6:.2f} µs/muestra, {elapsed / len(chunks) * 1e6:.2f} µs/evento")
+    for rate in (10, 50, 100):
+        print(f"  a {rate:>3} muestras/s: {per_sample * rate * 100:.4f} % del tiempo del loop BLE")
+
+# -------------------- Canal completo contra el hub simulado --------------------
+# El worker real (planificador, caché, streaming, trazas) en modo sin conexión,
+# alimentado por una entrada sintética o grabada (record_input en los ajustes). Los ajustes del
+# usuario no intervienen: se usa un archivo de ajustes temporal para que las ejecuciones sean
+# comparables entre sí.
+
+PIPELINE_MODES = ('streaming', 'programa')
+# Combinaciones habituales de teclas para la entrada sintética
+SYNTHETIC_KEYS = ('', 'w', 's', 'a', 'd', 'wd', 'wa', 'i', 'k', 'x', 'z', 'wx', 'm', 'n')
+
+def synthetic_trace(rate: float, duration: float, seed: int) -> list:
+    rng = random.Random(seed)
+    frames, keys = [], ''
+    for i in range(int(rate * duration)):
+        # Se mantiene la combinación la mitad de las veces, como al conducir de verdad
+        if rng.random() < 0.5:
+            keys = rng.choice(SYNTHETIC_KEYS)
+        frames.append({'t': i / rate, 'source': 'gui', 'keys': list(keys)})
+    frames.append({'t': duration, 'source': 'gui', 'keys': []})
+    return frames
+
+def load_trace(path: str) -> list:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class CompileCounter:
+    """Cuenta las llamadas a mpy-cross; con modelo, las sustituye por un coste fijo.
+
+    mpy-cross se distribuye como .exe: en Linux el modelo permite medir el resto del canal.
+    Su salida conserva el código fuente (y por tanto los nombres que reconoce el simulador).
+    """
+    def __init__(self, model_ms: Optional[float]):
+        self.model_ms = model_ms
+        self.calls = 0
+        self._originals = (mpy_cross_v5.mpy_cross_compile, mpy_cross_v6.mpy_cross_compile)
+
+    def install(self):
+        for module, original in zip((mpy_cross_v5, mpy_cross_v6), self._originals):
+            module.mpy_cross_compile = self._wrap(original)
+
+    def uninstall(self):
+        mpy_cross_v5.mpy_cross_compile, mpy_cross_v6.mpy_cross_compile = self._originals
+
+    def _wrap(self, original):
+        def compile(file_name, source, **kwargs):
+            self.calls += 1
+            if self.model_ms is None:
+                return original(file_name, source, **kwargs)
+            time.sleep(self.model_ms / 1000)
+            data = source.encode() if isinstance(source, str) else bytes(source)
+            return subprocess.CompletedProcess([], 0, b'', b''), b'M\x06\x00\x1f' + data
+        return compile
+
+def _mpy_cross_works() -> bool:
+    try:
+        proc, _ = mpy_cross_v6.mpy_cross_compile('prueba.py', 'x = 1')
+        return proc.returncode == 0
+    except Exception:
+        return False
+
+def _replay(worker: BLEWorker, frames: list):
+    # Mismo hilo que usarían la GUI o el mando: cada fotograma en su instante
+    start = time.perf_counter()
+    for frame in frames:
+        delay = start + frame['t'] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        source = frame.get('source', 'gui')
+        if 'key' in frame:
+            worker.set_key(frame['key'], frame['down'], source=source)
+        else:
+            keys = frame.get('keys')
+            speeds = frame.get('speeds')
+            worker.apply_input(keys=keys_mask(keys) if keys is not None else None,
+                               perpetual=frame.get('perpetual'), source=source,
+                               speeds=tuple(speeds) if speeds is not None else None)
+    return time.perf_counter() - start
+
+def _run_pipeline(mode: str, frames: list, link: dict, counter: CompileCounter, settle: float) -> dict:
+    log_queue = Queue()
+    worker = BLEWorker(log_queue, streaming=mode == 'streaming', offline=True)
+    worker.simulator.update(link)
+    calls_before = counter.calls
+    worker.start()
+    deadline = time.monotonic() + 30
+    while not worker.running.is_set():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"el hub simulado no llegó a conectar ({mode})")
+        time.sleep(0.01)
+    # La precompilación de la caché (modo programa) se hace en segundo plano al conectar
+    time.sleep(settle)
+    hubs = [session.hub for session in worker.sessions.values()]
+    calls_setup = counter.calls
+    air_before = sum(hub.bytes_sent + hub.bytes_received for hub in hubs)
+    packets_before = sum(hub.packets_sent + hub.packets_received for hub in hubs)
+
+    cpu_start = time.process_time()
+    elapsed = _replay(worker, frames)
+    time.sleep(settle)
+    cpu = time.process_time() - cpu_start
+
+    tracer = worker.tracer
+    commands = tracer.counts.get('total', 0)
+    result = {
+        'frames': len(frames),
+        'commands': commands,
+        'duration_s': round(elapsed, 3),
+        'commands_per_s': round(commands / elapsed, 2) if elapsed else 0.0,
+        'key_to_start_ms': {k: round(v, 3) for k, v in tracer.percentiles().get('total', {}).items()},
+        'stages_ms': {name: {k: round(v, 3) for k, v in p.items()}
+                      for name, p in tracer.percentiles().items() if name != 'total'},
+        'bytes_over_air': sum(hub.bytes_sent + hub.bytes_received for hub in hubs) - air_before,
+        'packets_over_air': sum(hub.packets_sent + hub.packets_received for hub in hubs) - packets_before,
+        'retransmissions': sum(hub.retransmissions for hub in hubs),
+        'mpy_cross_setup': calls_setup - calls_before,
+        'mpy_cross_replay': counter.calls - calls_setup,
+        'cpu_ms_per_command': round(cpu * 1000 / commands, 3) if commands else None,
+        'ticks': worker.metrics['ticks'],
+        'idle_ticks': worker.metrics['idle_ticks'],
+        'ticker_wakeups': worker.metrics['ticker_wakeups'],
+        'claw_dropped': worker.metrics['claw_dropped'],
+    }
+    worker.stop()
+    worker.thread.join(timeout=5)
+    return result
+
+PIPELINE_SUMMARY = (
+    ('órdenes/s', 'commands_per_s', "{:.1f}"),
+    ('tecla→inicio p50', ('key_to_start_ms', 'p50'), "{:.2f} ms"),
+    ('tecla→inicio p95', ('key_to_start_ms', 'p95'), "{:.2f} ms"),
+    ('tecla→inicio p99', ('key_to_start_ms', 'p99'), "{:.2f} ms"),
+    ('bytes por el aire', 'bytes_over_air', "{:d}"),
+    ('mpy-cross (conexión)', 'mpy_cross_setup', "{:d}"),
+    ('mpy-cross (reproducción)', 'mpy_cross_replay', "{:d}"),
+    ('CPU por orden', 'cpu_ms_per_command', "{:.3f} ms"),
+    ('despertares del ticker', 'ticker_wakeups', "{:d}"),  # sólo el ticker, no el mando ni la GUI
+    ('ticks sin envío', 'idle_ticks', "{:d}"),
+    ('garra descartadas', 'claw_dropped', "{:d}"),
+)
+
+def _metric(result: dict, key):
+    if isinstance(key, tuple):
+        return result.get(key[0], {}).get(key[1])
+    return result.get(key)
+
+def bench_pipeline(args):
+    frames = load_trace(args.trace) if args.trace else synthetic_trace(args.rate, args.duration, args.seed)
+    link = {'latency': args.latency / 1000, 'jitter': args.jitter / 1000, 'mtu': args.mtu, 'loss': args.loss}
+
+    if args.compiler == 'auto':
+        args.compiler = 'mpy-cross' if _mpy_cross_works() else 'modelo'
+    counter = CompileCounter(None if args.compiler == 'mpy-cross' else args.compile_ms)
+    counter.install()
+    random.seed(args.seed)
+
+    # Ajustes aislados: los hubs recordados del usuario no cuentan
+    settings_path = SistemaControlSpike.SETTINGS_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        SistemaControlSpike.SETTINGS_PATH = os.path.join(tmp, 'ajustes.json')
+        try:
+            modes = PIPELINE_MODES if args.mode == 'ambos' else (args.mode,)
+            results = {mode: _run_pipeline(mode, frames, link, counter, args.settle) for mode in modes}
+        finally:
+            SistemaControlSpike.SETTINGS_PATH = settings_path
+            counter.uninstall()
+
+    report = {
+        'benchmark': 'pipeline',
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'config': {
+            'trace': args.trace or f"sintética ({args.rate:g} Hz, {args.duration:g} s, semilla {args.seed})",
+            'link': link,
+            'compiler': args.compiler,
+            'compile_ms': args.compile_ms if args.compiler == 'modelo' else None,
+        },
+        'results': results,
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f).get('results', {})
+
+    print(f"Entrada: {report['config']['trace']}, {len(frames)} fotogramas")
+    print(f"Enlace: {args.latency:g} ± {args.jitter:g} ms, MTU {args.mtu}, pérdida {args.loss:.0%}; "
+          f"compilador: {args.compiler}")
+    for mode, result in results.items():
+        print(f"\n[{mode}] {result['commands']} órdenes en {result['duration_s']:.1f} s")
+        if mode == 'streaming':
+            # Sin confirmación por línea: el hub la aplica una latencia de enlace después
+            print(f"  (tecla→inicio termina al escribir en stdin; el hub la recibe ~{args.latency:g} ms después)")
+        for label, key, fmt in PIPELINE_SUMMARY:
+            value = _metric(result, key)
+            text = fmt.format(value) if value is not None else '—'
+            before = _metric(previous.get(mode, {}), key) if previous else None
+            if isinstance(before, (int, float)) and isinstance(value, (int, float)) and before:
+                text += f"  ({(value - before) / before:+.1%} frente a la anterior)"
+            print(f"  {label:<26} {text}")
+        for name, p in result['stages_ms'].items():
+            print(f"    {name:<24} p50 {p['p50']:>8.2f}  p95 {p['p95']:>8.2f}  p99 {p['p99']:>8.2f} ms")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.json}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del canal de control LEGO SPIKE")
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('download', help="descarga de programas: completa vs. delta")
+    p.add_argument('--sizes', type=int, nargs='+', default=[2048, 8192, 32768])
+    p.add_argument('--interval', type=float, default=15.0, help="intervalo de conexión en ms")
+    p.set_defaults(func=bench_download)
+
+    p = sub.add_parser('fleet', help="modo flota: conexión concurrente y reparto de órdenes")
+    p.add_argument('--max-hubs', type=int, default=FLEET_MAX_HUBS, help="límite de enlaces del adaptador")
+    p.add_argument('--interval', type=float, default=15.0, help="intervalo de conexión en ms")
+    p.add_argument('--establish', type=float, default=150.0, help="establecimiento del enlace en ms")
+    p.add_argument('--discovery', type=float, default=900.0, help="descubrimiento GATT en ms")
+    p.add_argument('--commands', type=int, default=20)
+    p.set_defaults(func=bench_fleet)
+
+    p = sub.add_parser('input', help="resolución de teclas a (drive, claw) por fotograma")
+    p.add_argument('--frames', type=int, default=200000)
+    p.set_defaults(func=bench_input)
+
+    p = sub.add_parser('telemetry', help="coste de decodificar la telemetría del hub")
+    p.add_argument('--samples', type=int, default=20000)
+    p.add_argument('--mtu', type=int, default=20, help="tamaño de los eventos WRITE_STDOUT")
+    p.set_defaults(func=bench_telemetry)
+
+    p = sub.add_parser('pipeline', help="canal completo (worker + hub simulado): órdenes/s, latencia, bytes")
+    p.add_argument('--trace', help="entrada grabada (JSON Lines, ajuste 'record_input'); si no, sintética")
+    p.add_argument('--rate', type=float, default=20.0, help="fotogramas/s de la entrada sintética")
+    p.add_argument('--duration', type=float, default=10.0, help="segundos de entrada sintética")
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--mode', choices=PIPELINE_MODES + ('ambos',), default='ambos')
+    p.add_argument('--latency', type=float, default=SIMULATOR_DEFAULTS['latency'] * 1000, help="ms por sentido")
+    p.add_argument('--jitter', type=float, default=SIMULATOR_DEFAULTS['jitter'] * 1000, help="ms")
+    p.add_argument('--mtu', type=int, default=SIMULATOR_DEFAULTS['mtu'])
+    p.add_argument('--loss', type=float, default=SIMULATOR_DEFAULTS['loss'], help="probabilidad de pérdida por paquete")
+    p.add_argument('--compiler', choices=('auto', 'mpy-cross', 'modelo'), default='auto')
+    p.add_argument('--compile-ms', type=float, default=20.0, help="coste de una compilación con el modelo")
+    p.add_argument('--settle', type=float, default=1.5, help="espera tras conectar y al terminar (s)")
+    p.add_argument('--json', help="guardar los resultados en este archivo")
+    p.add_argument('--compare', help="resultados JSON de una ejecución anterior")
+    p.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# La aplicación es un script en src/ (no un paquete instalable)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+from SistemaControlSpike import TELEMETRY_STRUCT, TELEMETRY_SYNC
+
+@pytest.fixture
+def frame():
+    """Construye una trama de telemetría válida (número de secuencia y ángulo de la garra)."""
+    def build(seq, e_angle=0):
+        values = [TELEMETRY_SYNC, seq, 1000] + [0] * 6 + [e_angle, 0, 0] + [8000, 0, 0, 90]
+        data = TELEMETRY_STRUCT.pack(*values)
+        return data + bytes((sum(data) & 0xFF,))
+    return build
@@ -0,0 +1,65 @@
+from SistemaControlSpike import CLAW_CLOSED, CLAW_MARGIN, CLAW_OPEN, ClawMirror, TelemetryDecoder
+
+def closed_mirror():
+    mirror = ClawMirror()
+    mirror.position = CLAW_OPEN
+    mirror.issue('cerrar', 0.0)
+    return mirror
+
+def test_estimate_integrates_issued_moves():
+    mirror = closed_mirror()
+    assert mirror.moving(1.0)
+    assert mirror.estimate(1.0) == CLAW_OPEN + 200
+    assert mirror.estimate(100.0) == CLAW_CLOSED
+    assert not mirror.moving(100.0)
+
+def test_unknown_position_is_never_redundant():
+    assert not ClawMirror().redundant('cerrar', 0.0)
+
+def test_absolute_target_already_reached_is_redundant():
+    mirror = closed_mirror()
+    assert mirror.redundant('cerrar', 100.0)
+    assert not mirror.redundant('abrir', 100.0)
+
+def test_moving_towards_same_target_is_redundant():
+    mirror = closed_mirror()
+    assert mirror.redundant('cerrar', 1.0)
+    assert not mirror.redundant('abrir', 1.0)
+
+def test_nudges_and_stop_are_never_redundant():
+    mirror = closed_mirror()
+    for claw_cmd in ('cerrar_lento', 'abrir_lento', 'stop'):
+        assert not mirror.redundant(claw_cmd, 100.0)
+
+def test_filter_records_stopped_claw():
+    mirror = closed_mirror()
+    last = {'drive': 'stop', 'claw': 'stop', 'speeds': None}
+    state = {'drive': 'adelante', 'claw': 'cerrar', 'speeds': None}
+    assert mirror.filter(state, last, 100.0)
+    assert state == {'drive': 'adelante', 'claw': 'stop', 'speeds': None}
+
+def test_filter_keeps_repeated_nudges():
+    # Tras un ajuste lento y soltar la tecla, el siguiente ajuste debe enviarse
+    mirror = ClawMirror()
+    mirror.position = CLAW_OPEN
+    mirror.issue('cerrar_lento', 0.0)
+    mirror.issue('stop', 100.0)
+    state = {'drive': 'stop', 'claw': 'cerrar_lento', 'speeds': None}
+    assert not mirror.filter(state, {'drive': 'stop', 'claw': 'stop', 'speeds': None}, 101.0)
+    assert state['claw'] == 'cerrar_lento'
+
+def test_filter_only_after_stop():
+    mirror = closed_mirror()
+    state = {'drive': 'stop', 'claw': 'cerrar', 'speeds': None}
+    assert not mirror.filter(state, {'drive': 'stop', 'claw': 'cerrar_lento', 'speeds': None}, 100.0)
+    assert not mirror.filter(state, {'drive': None, 'claw': None, 'speeds': None}, 100.0)
+
+def test_telemetry_overrides_estimate(frame):
+    mirror = closed_mirror()
+    decoder = TelemetryDecoder()
+    decoder.feed(frame(1, e_angle=700))
+    mirror.observe(decoder, CLAW_MARGIN + 1.0)
+    # Motor parado en 700 (p. ej. garra atascada en un objeto): el movimiento terminó allí
+    assert not mirror.moving(CLAW_MARGIN + 1.0)
+    assert mirror.estimate(CLAW_MARGIN + 1.0) == 700
+    assert not mirror.redundant('cerrar', CLAW_MARGIN + 1.0)
@@ -0,0 +1,68 @@
+import asyncio
+import struct
+
+from pybricksdev.ble.pybricks import Command  # type: ignore
+
+from SistemaControlSpike import SpikeHubMixin
+
+class RamHub(SpikeHubMixin):
+    """Hub sin enlace real que guarda la RAM de programa de cada ranura."""
+    _max_write_size = 20
+    _max_user_program_size = 4096
+
+    def __init__(self):
+        self._selected_slot = 0
+        self.ram = {}
+        self.ram_writes = 0
+        self.unacked = 0
+
+    async def write_gatt_char(self, uuid: str, data, response: bool):
+        data = bytes(data)
+        if data[0] == Command.COMMAND_WRITE_USER_RAM:
+            offset = struct.unpack_from('<I', data, 1)[0]
+            ram = self.ram.setdefault(self._selected_slot, bytearray(64))
+            ram[offset:offset + len(data) - 5] = data[5:]
+            self.ram_writes += 1
+            self.unacked += not response
+
+def download(hub, program):
+    asyncio.run(hub.download_user_program(program))
+
+PROGRAM = bytes(range(45))
+
+def test_identical_program_is_not_resent():
+    hub = RamHub()
+    download(hub, PROGRAM)
+    writes = hub.ram_writes
+    download(hub, PROGRAM)
+    assert hub.ram_writes == writes
+
+def test_only_changed_chunks_are_rewritten():
+    hub = RamHub()
+    download(hub, PROGRAM)
+    writes = hub.ram_writes
+    changed = PROGRAM[:20] + b'\xff' + PROGRAM[21:]
+    download(hub, changed)
+    assert hub.ram_writes == writes + 1
+    assert bytes(hub.ram[0][:45]) == changed
+
+def test_delta_is_kept_per_slot():
+    hub = RamHub()
+    download(hub, PROGRAM)
+    # Cambio de ranura en el hub: la nueva no tiene nada en común con la anterior
+    hub._selected_slot = 1
+    changed = PROGRAM[:20] + b'\xff' + PROGRAM[21:]
+    download(hub, changed)
+    assert bytes(hub.ram[1][:45]) == changed
+    # De vuelta a la primera ranura, el delta sigue valiendo contra lo que hay en ella
+    hub._selected_slot = 0
+    writes = hub.ram_writes
+    download(hub, PROGRAM)
+    assert hub.ram_writes == writes
+
+def test_ram_writes_are_always_acknowledged():
+    # Aunque el enlace admita escritura sin respuesta, un fragmento rechazado pasaría inadvertido
+    hub = RamHub()
+    hub._command_write_without_response = lambda: True
+    download(hub, PROGRAM)
+    assert hub.unacked == 0
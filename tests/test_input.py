@@ -0,0 +1,23 @@
+from SistemaControlSpike import COMMAND_TABLE, INPUT_KEYS, KEY_BIT, compute_drive_command, keys_mask
+
+def test_keys_mask():
+    assert keys_mask('') == 0
+    assert keys_mask('wx') == KEY_BIT['w'] | KEY_BIT['x']
+    # Las teclas desconocidas se ignoran
+    assert keys_mask('w?') == KEY_BIT['w']
+
+def test_table_covers_every_combination():
+    assert len(COMMAND_TABLE) == 1 << len(INPUT_KEYS)
+    assert COMMAND_TABLE[0] == ('stop', 'stop')
+
+def test_drive_and_claw_resolve_independently():
+    assert COMMAND_TABLE[keys_mask('wx')] == ('adelante', 'cerrar')
+    assert COMMAND_TABLE[keys_mask('dn')] == ('derecha', 'abrir_lento')
+
+def test_opposite_keys_cancel():
+    assert COMMAND_TABLE[keys_mask('ws')] == ('stop', 'stop')
+    assert COMMAND_TABLE[keys_mask('xz')] == ('stop', 'stop')
+
+def test_slow_drive_has_priority():
+    assert compute_drive_command({'w', 'i'}) == 'adelante_lento'
+    assert compute_drive_command({'k', 'a'}) == 'atras_lento'
@@ -0,0 +1,132 @@
+import sys
+import types
+
+import pytest
+
+from SistemaControlSpike import (
+    CLAW_INDEX, DRIVE_INDEX, create_program, create_resident_program, encode_channel_command,
+    encode_claw_command, encode_drive_command, encode_speed_command, encode_state_command,
+    encode_stream_command, encode_telemetry_command, encode_watchdog_command, state_is_idle,
+)
+
+class _Halt(Exception):
+    """Corta el bucle principal del intérprete residente tras una vuelta."""
+
+class _Motor:
+    def __init__(self, port, reset_angle=True):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name,) + args)
+            return 0
+        return call
+
+    def done(self):
+        return True
+
+class _Stdin:
+    def __init__(self, data: bytes):
+        self.data = data.decode()
+
+    def read(self, n):
+        ch, self.data = self.data[:n], self.data[n:]
+        return ch
+
+@pytest.fixture
+def run_resident(monkeypatch):
+    """Ejecuta create_resident_program() con módulos pybricks falsos sobre una entrada dada.
+
+    El bucle principal da una sola vuelta (wait corta la ejecución) después de consumir la
+    entrada. Devuelve el espacio de nombres del programa.
+    """
+    def run(data: bytes) -> dict:
+        stdin = _Stdin(data)
+
+        def wait(ms):
+            raise _Halt
+
+        class Poll:
+            def register(self, stream):
+                pass
+
+            def poll(self, timeout):
+                return bool(stdin.data)
+
+        hub = types.SimpleNamespace(
+            imu=types.SimpleNamespace(tilt=lambda: (0, 0), heading=lambda: 0),
+            battery=types.SimpleNamespace(voltage=lambda: 8000))
+        modules = {
+            'pybricks': types.ModuleType('pybricks'),
+            'pybricks.hubs': types.SimpleNamespace(PrimeHub=lambda: hub),
+            'pybricks.pupdevices': types.SimpleNamespace(Motor=_Motor),
+            'pybricks.parameters': types.SimpleNamespace(Port=types.SimpleNamespace(A='A', C='C', E='E')),
+            'pybricks.tools': types.SimpleNamespace(wait=wait, StopWatch=lambda: types.SimpleNamespace(time=lambda: 0)),
+            'usys': types.SimpleNamespace(stdin=stdin, stdout=None),
+            'uselect': types.SimpleNamespace(poll=Poll),
+            'ustruct': types.SimpleNamespace(pack=None),
+        }
+        for name, module in modules.items():
+            monkeypatch.setitem(sys.modules, name, module)
+        ns = {}
+        with pytest.raises(_Halt):
+            exec(compile(create_resident_program(), 'residente', 'exec'), ns)
+        return ns
+    return run
+
+def test_stream_command_uses_table_indexes():
+    line = encode_stream_command('adelante', 'cerrar')
+    assert line == f"M{DRIVE_INDEX['adelante']}{CLAW_INDEX['cerrar']}\n".encode()
+
+def test_unknown_commands_encode_as_stop():
+    assert encode_stream_command('volar', 'girar') == encode_stream_command('stop', 'stop')
+    assert encode_drive_command('volar') == encode_drive_command('stop')
+    assert encode_claw_command('girar') == encode_claw_command('stop')
+
+def test_single_digit_indexes():
+    # El intérprete residente lee un dígito por canal
+    assert len(DRIVE_INDEX) <= 10 and len(CLAW_INDEX) <= 10
+
+def test_speed_telemetry_and_watchdog_lines():
+    assert encode_speed_command((-120, 400)) == b"V-120,400\n"
+    assert encode_telemetry_command(10.0) == b"T100\n"
+    assert encode_telemetry_command(0) == b"T0\n"
+    assert encode_watchdog_command(0.75) == b"W750\n"
+
+def test_channel_command_sends_only_what_changed():
+    last = {'drive': 'stop', 'claw': 'cerrar', 'speeds': None}
+    assert encode_channel_command(last, dict(last, drive='adelante')) == encode_drive_command('adelante')
+    assert encode_channel_command(last, dict(last, claw='abrir')) == encode_claw_command('abrir')
+    both = {'drive': 'adelante', 'claw': 'abrir', 'speeds': None}
+    assert encode_channel_command(last, both) == encode_stream_command('adelante', 'abrir')
+
+def test_channel_command_after_connect_sends_everything():
+    last = {'drive': None, 'claw': None, 'speeds': None}
+    state = {'drive': 'stop', 'claw': 'stop', 'speeds': None}
+    assert encode_channel_command(last, state) == encode_stream_command('stop', 'stop')
+
+def test_state_command_repeats_full_state():
+    assert encode_state_command({'drive': 'atras', 'claw': 'abrir', 'speeds': None}) == \
+        encode_stream_command('atras', 'abrir')
+    assert encode_state_command({'drive': 'adelante', 'claw': 'stop', 'speeds': (10, 20)}) == \
+        encode_speed_command((10, 20))
+
+def test_state_is_idle():
+    assert state_is_idle({'drive': None, 'claw': None, 'speeds': None})
+    assert state_is_idle({'drive': 'stop', 'claw': 'stop', 'speeds': None})
+    assert not state_is_idle({'drive': 'stop', 'claw': 'cerrar_lento', 'speeds': None})
+    assert not state_is_idle({'drive': 'adelante', 'claw': 'stop', 'speeds': None})
+    assert not state_is_idle({'drive': 'stop', 'claw': 'stop', 'speeds': (0, 40)})
+
+def test_generated_programs_are_valid_python():
+    compile(create_resident_program(), 'residente', 'exec')
+    compile(create_program('adelante', 'cerrar'), 'orden', 'exec')
+    compile(create_program('stop', 'abrir_lento', hold_ms=750), 'orden', 'exec')
+
+def test_resident_ignores_bad_lines(run_resident):
+    # Índices fuera de rango y números mal formados no terminan el intérprete ni cambian el estado;
+    # la línea válida que llega después se aplica
+    ns = run_resident(b"M9\nC7\nD99\nDx\nT\n" + encode_drive_command('adelante'))
+    assert ns['state'] == [DRIVE_INDEX['adelante'], CLAW_INDEX['stop'], 0, 0]
+    assert ns['motorE'].calls == []
+    assert ns['motorA'].calls == [('stop',)] and ns['motorC'].calls == [('run', 400)]
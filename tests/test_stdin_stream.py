@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from SistemaControlSpike import SpikeHubMixin
+
+class FlakyHub(SpikeHubMixin):
+    """Hub sin enlace real: las primeras `failures` escrituras de stdin fallan."""
+    _max_write_size = 20
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.received = []
+
+    async def _write_stdin_packet(self, data: bytes, response: bool):
+        await asyncio.sleep(0)
+        if self.failures:
+            self.failures -= 1
+            raise OSError("operation in progress")
+        self.received.append(data)
+
+def test_failed_write_is_reported_and_stream_recovers():
+    async def scenario(hub):
+        with pytest.raises(OSError):
+            await hub.write(b"M00\n")
+            await hub.stdin_stream().flush()
+        await hub.write(b"M84\n")
+        await hub.stdin_stream().flush()
+
+    hub = FlakyHub(failures=1)
+    asyncio.run(scenario(hub))
+    assert hub.received == [b"M84\n"]
+
+def test_small_writes_are_batched_into_packets():
+    async def scenario(hub):
+        for line in (b"D0\n", b"C1\n", b"D8\n"):
+            hub.stdin_stream().write(line)
+        await hub.stdin_stream().flush()
+
+    hub = FlakyHub(failures=0)
+    asyncio.run(scenario(hub))
+    assert b"".join(hub.received) == b"D0\nC1\nD8\n"
+    assert len(hub.received) == 1
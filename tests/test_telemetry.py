@@ -0,0 +1,32 @@
+from SistemaControlSpike import TELEMETRY_FIELDS, TELEMETRY_SYNC, TelemetryDecoder
+
+def test_decodes_frames_split_across_packets(frame):
+    decoder = TelemetryDecoder()
+    data = frame(1, 300) + frame(2, 310)
+    for i in range(0, len(data), 7):
+        decoder.feed(data[i:i + 7])
+    assert decoder.frames == 2
+    sample = decoder.latest()
+    assert set(sample) == set(TELEMETRY_FIELDS)
+    assert sample['seq'] == 2 and sample['e_angle'] == 310 and sample['battery_mv'] == 8000
+
+def test_resynchronizes_after_garbage_and_false_sync(frame):
+    decoder = TelemetryDecoder()
+    decoder.feed(b"Traceback\n" + bytes((TELEMETRY_SYNC, 1, 2)) + frame(5))
+    assert decoder.frames == 1
+    assert decoder.errors >= 1
+    assert decoder.latest()['seq'] == 5
+
+def test_bad_checksum_is_dropped(frame):
+    decoder = TelemetryDecoder()
+    bad = bytearray(frame(1))
+    bad[-1] ^= 0xFF
+    decoder.feed(bytes(bad))
+    assert decoder.frames == 0
+    assert decoder.latest() is None
+
+def test_history_is_bounded(frame):
+    decoder = TelemetryDecoder(history=4)
+    decoder.feed(b"".join(frame(i) for i in range(10)))
+    assert decoder.frames == 10
+    assert len(decoder.samples) == 4
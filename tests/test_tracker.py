@@ -0,0 +1,46 @@
+import asyncio
+
+from pybricksdev.ble.pybricks import StatusFlag
+from reactivex.subject import BehaviorSubject
+
+from SistemaControlSpike import ProgramTracker
+
+class StatusHub:
+    """Hub mínimo: sólo status_observable y STOP, que informa la parada tras `delay` segundos."""
+    def __init__(self, flags: StatusFlag, delay: float = 0.0):
+        self.status_observable = BehaviorSubject(flags)
+        self.delay = delay
+        self.stops = 0
+
+    async def stop_user_program(self):
+        self.stops += 1
+        if self.delay:
+            asyncio.get_running_loop().call_later(
+                self.delay, self.status_observable.on_next, StatusFlag(0))
+
+def test_stop_returns_at_once_when_program_already_ended():
+    async def scenario():
+        # El programa terminó sin que el hub llegara a informar que estaba en marcha
+        hub = StatusHub(StatusFlag(0))
+        tracker = ProgramTracker(hub)
+        tracker.started(('forward', 'stop', 0))
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        assert await tracker.stop(timeout=0.5)
+        return hub, tracker, loop.time() - start
+
+    hub, tracker, elapsed = asyncio.run(scenario())
+    assert elapsed < 0.1
+    assert hub.stops == 1
+    assert not tracker.running and tracker.command is None
+
+def test_stop_waits_for_reported_stop():
+    async def scenario():
+        hub = StatusHub(StatusFlag.USER_PROGRAM_RUNNING, delay=0.02)
+        tracker = ProgramTracker(hub)
+        tracker.started(('forward', 'stop', 0))
+        return await tracker.stop(timeout=0.5), tracker
+
+    stopped, tracker = asyncio.run(scenario())
+    assert stopped
+    assert not tracker.running